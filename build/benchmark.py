@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# benchmark.py
+# End-to-end latency benchmark: scale -> interrupt -> capture -> stable -> saved -> uploaded.
+#
+# Runs the station against a simulated scale (scale_sim.py on a pty), the synthetic
+# camera and a local HTTP stand-in for the upload API, all under a throwaway config
+# (OPTIWASTE_CONFIG) in a temp directory, so the station's own files in build/ are
+# not touched. Every process appends stage timestamps to one trace file
+# (stage_trace.py); they are joined per item and reported as p50/p95/p99 per stage
+# plus items per minute, and written as JSON (build/benchmark_results.json unless
+# --out says otherwise, ignored by git) so runs from different releases can be
+# compared (--baseline).
+#
+# gui14.py needs a display: it is used when $DISPLAY is set or xvfb-run exists.
+# Otherwise (or with --no-gui) the harness stands in for the GUI's save step, so
+# the scale, stability and upload stages are still measured.
+import os, sys, json, time, shutil, signal, argparse, platform, subprocess, tempfile, threading
+from datetime import datetime
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BASE = Path(__file__).resolve().parent
+
+# (name, from stage, to stage) measured per item; "land" is the simulator's ground truth
+SPANS = [
+    ("land->interrupt", "land", "interrupt"),
+    ("interrupt->trigger", "interrupt", "trigger"),
+    ("interrupt->captured", "interrupt", "captured"),
+    ("interrupt->stable", "interrupt", "stable"),
+    ("stable->saved", "stable", "saved"),
+    ("saved->prepared", "saved", "prepared"),
+    ("saved->uploaded", "saved", "uploaded"),
+    ("land->uploaded", "land", "uploaded"),
+]
+
+
+def load_config(file):
+    return {k.strip(): v.strip() for k, v in (line.split("=", 1) for line in open(file) if "=" in line)}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(q / 100 * len(s) + 0.5)) - 1))]
+
+
+class UploadEndpoint(ThreadingHTTPServer):
+    """Accepts the uploader's multipart POSTs and answers 200, like upload_image.php."""
+
+    def __init__(self):
+        self.requests, self.bytes = 0, 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(h):
+                n = int(h.headers.get("Content-Length", 0))
+                h.rfile.read(n)
+                self.requests, self.bytes = self.requests + 1, self.bytes + n
+                h.send_response(200)
+                h.send_header("Content-Length", "2")
+                h.end_headers()
+                h.wfile.write(b"OK")
+
+            def log_message(h, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/upload_image.php"
+
+
+def read_trace(path):
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def emulate_gui_saves(trace_path, save_dir, queue_path, catalog_path, device, stop):
+    """--no-gui: for each stable weight, save a JPEG, record it in the catalog and queue it, as gui14.py would."""
+    from PIL import Image
+    from stage_trace import StageTrace
+    from catalog import Catalog
+    import upload_queue
+    from spool import shard
+    out, catalog = StageTrace(str(trace_path)), Catalog(catalog_path)
+    seen, image = 0, Image.new("RGB", (1296, 2304), (96, 128, 96))
+    while not stop.is_set():
+        stables = [r for r in read_trace(trace_path) if r["stage"] == "stable"]
+        for r in stables[seen:]:
+            now = datetime.now()
+            cid = catalog.new_capture(device, now.timestamp())
+            name = f"{device}_{now:%H-%M-%S_%Y-%m-%d}_{r['weight']:.2f}".replace(".", "x") + f"_{cid}.jpg"
+            day = shard(save_dir, now)
+            day.mkdir(parents=True, exist_ok=True)
+            part = day / f"{name}.part"
+            image.save(part, "JPEG")
+            os.replace(part, day / name)
+            rel = f"{day.name}/{name}"
+            catalog.mark_saved(cid, rel, r["weight"], predicted=r.get("predicted", False))
+            out.mark("saved", name)
+            upload_queue.append(queue_path, rel)
+        seen = len(stables)
+        stop.wait(0.05)
+    out.close()
+    catalog.close()
+
+
+def read_status(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def join_items(records, truth):
+    """Group trace records per item. Stages up to stable_seen follow the interrupt that opened
+    the item; saved, prepared and uploaded are matched by file name, since uploads can lag behind."""
+    items, by_name = [], {}
+    for r in sorted(records, key=lambda r: r["t"]):
+        st = r["stage"]
+        if st == "interrupt":
+            items.append({"interrupt": r["t"], "weight": r.get("weight")})
+        elif not items:
+            continue
+        elif st in ("trigger", "captured", "stable", "stable_seen"):
+            cur = items[-1]
+            if st not in cur:
+                cur[st] = r["t"]
+                if st == "stable":
+                    cur["stable_weight"], cur["predicted"] = r.get("weight"), bool(r.get("predicted"))
+                if st == "stable_seen":
+                    by_name[r["item"]] = cur
+    # Without the GUI, saves carry no stable_seen link: pair them with stable items in order
+    pending = [it for it in items if "stable" in it and "stable_seen" not in it]
+    for r in sorted(records, key=lambda r: r["t"]):
+        if r["stage"] == "saved":
+            it = by_name.get(r["item"]) or (pending.pop(0) if pending else None)
+            if it is not None and "saved" not in it:
+                it["saved"] = r["t"]
+                by_name[r["item"]] = it
+        elif r["stage"] == "prepared" and r["item"] in by_name:
+            by_name[r["item"]].setdefault("prepared", r["t"])
+            by_name[r["item"]].setdefault("cpu_ms", r.get("cpu_ms"))
+        elif r["stage"] == "uploaded" and r["item"] in by_name:
+            by_name[r["item"]].setdefault("uploaded", r["t"])
+            by_name[r["item"]]["bytes"] = r.get("bytes")
+    for it in items:
+        lands = [t for t in truth if t["t_monotonic"] <= it["interrupt"]]
+        if lands:
+            it["land"], it["true_weight"] = lands[-1]["t_monotonic"], lands[-1]["weight"]
+    return items
+
+
+def summarize(items, meta):
+    stages = {}
+    for name, a, b in SPANS:
+        vals = [(it[b] - it[a]) * 1000 for it in items if a in it and b in it]
+        if vals:
+            stages[name] = {"n": len(vals), "p50": percentile(vals, 50), "p95": percentile(vals, 95),
+                            "p99": percentile(vals, 99), "max": max(vals)}
+    done = [it for it in items if "uploaded" in it]
+    span = (max(it["uploaded"] for it in done) - min(it.get("land", it["interrupt"]) for it in done)) if done else 0
+    errors = [abs(it["stable_weight"] - it["true_weight"]) for it in items if "stable_weight" in it and "true_weight" in it]
+    return {
+        "meta": meta,
+        "items": {"interrupts": len(items), "stable": sum("stable" in it for it in items),
+                  "saved": sum("saved" in it for it in items), "uploaded": len(done)},
+        "items_per_minute": round(len(done) / span * 60, 2) if span > 0 else None,
+        "stages_ms": {k: {m: round(v, 1) if m != "n" else v for m, v in s.items()} for k, s in stages.items()},
+        "weight_error_kg": {"p50": round(percentile(errors, 50), 4), "max": round(max(errors), 4)} if errors else None,
+    }
+
+
+def print_report(result, baseline=None):
+    print(f"\n{'stage':22} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}" + ("  p95 vs baseline" if baseline else ""))
+    for name, s in result["stages_ms"].items():
+        line = f"{name:22} {s['n']:>4} {s['p50']:>9.1f} {s['p95']:>9.1f} {s['p99']:>9.1f}"
+        old = (baseline or {}).get("stages_ms", {}).get(name)
+        if old and old["p95"]:
+            line += f"  {(s['p95'] - old['p95']) / old['p95'] * 100:+.0f}%"
+        print(line)
+    print(f"items: {result['items']}, {result['items_per_minute']} items/min, weight error {result['weight_error_kg']}")
+    startup = result.get("meta", {}).get("startup_s")
+    if startup:
+        print("GUI start-up: " + ", ".join(f"{k.replace('_', ' ')} {v:.2f} s" for k, v in startup.items()))
+    services = result.get("meta", {}).get("services")
+    if services:
+        print(f"services ({services['mode']}): {services['total']['processes']} processes, {services['total']['rss_mb']} MB RSS; "
+              + ", ".join(f"{n} {v['health']}" for n, v in services["services"].items()))
+
+
+def regressions(result, baseline, tolerance, floor_ms=50):
+    """Stages whose p95 grew by more than `tolerance` and by more than floor_ms (sub-ms stages are jitter)."""
+    out = []
+    for name, s in result["stages_ms"].items():
+        old = baseline.get("stages_ms", {}).get(name)
+        if old and old["p95"] and s["p95"] > old["p95"] * (1 + tolerance) and s["p95"] - old["p95"] > floor_ms:
+            out.append(name)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="End-to-end latency benchmark for the weighing station")
+    ap.add_argument("--items", type=int, default=10)
+    ap.add_argument("--scenario", default="bouncy")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--hz", type=float, default=50, help="simulated scale rate")
+    ap.add_argument("--idle", type=float, default=2.0)
+    ap.add_argument("--hold", type=float, default=5.0)
+    ap.add_argument("--upload-interval", type=int, default=600, help="seconds between reconciliation sweeps")
+    ap.add_argument("--upload-profile", default="original", help='UPLOAD_PROFILE for the uploader, e.g. "max_dim=1600 quality=80"')
+    ap.add_argument("--service-mode", default="threads", choices=["threads", "processes"], help="SERVICE_MODE for supervisor.py")
+    ap.add_argument("--gui", dest="gui", action="store_true", default=None, help="run gui14.py (needs a display or xvfb-run)")
+    ap.add_argument("--no-gui", dest="gui", action="store_false")
+    ap.add_argument("--drain", type=float, default=30, help="max seconds to wait for uploads after the last item")
+    ap.add_argument("--out", default=str(BASE / "benchmark_results.json"), help="results JSON (default: next to this script)")
+    ap.add_argument("--baseline", help="earlier results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth vs baseline before failing")
+    ap.add_argument("--keep", action="store_true", help="keep the temp directory with logs and trace")
+    a = ap.parse_args(argv)
+
+    xvfb = shutil.which("xvfb-run")
+    gui = a.gui if a.gui is not None else bool(os.environ.get("DISPLAY") or xvfb)
+    tmp = Path(tempfile.mkdtemp(prefix="optiwaste-bench-"))
+    trace_path = tmp / "trace.jsonl"
+    for d in ("saved", "temp"):
+        (tmp / d).mkdir()
+    endpoint = UploadEndpoint()
+
+    cfg = load_config(BASE / "config.txt")
+    assets = Path(cfg.get("ASSETS_PATH", ""))
+    cfg.update({
+        "ASSETS_PATH": str(assets if assets.is_dir() else BASE / "assets" / "frame0"),
+        "DATA_FILE": str(tmp / "final_weight_interrupt.txt"),
+        "STABLE_LOG_FILE": str(tmp / "stable_weight_log.txt"),
+        "STABILITY_LOG_FILE": str(tmp / "stability_details.txt"),
+        "LOG_FILE": str(tmp / "gui.log"),
+        "INTERRUPT_SCRIPT": str(BASE / "interrupt_weightread_stability.py"),
+        "WEIGHT_CHANNEL": f"/dev/shm/optiwaste_bench_{os.getpid()}",
+        "WEIGHT_SOURCE": "serial",
+        "SCALE_PORT": str(tmp / "scale"),
+        "SERIAL_COMMAND_SOCKET": str(tmp / "serial.sock"),
+        "CAMERA": "synthetic",
+        "SAVE_FOLDER": str(tmp / "saved"),
+        "TEMP_FOLDER": str(tmp / "temp"),
+        "UPLOAD_URL": endpoint.url,
+        "UPLOAD_INTERVAL": str(a.upload_interval),
+        "UPLOAD_LOG": str(tmp / "upload_log.txt"),
+        "UPLOADER_LOG": str(tmp / "uploader.log"),
+        "UPLOAD_QUEUE": str(tmp / "upload_queue.txt"),
+        "CATALOG": str(tmp / "catalog.db"),
+        "UPLOAD_STATUS": str(tmp / "upload_status.json"),
+        "UPLOAD_PROFILE": a.upload_profile,
+        "UPLOAD_CACHE": str(tmp / "upload_cache"),
+        "TRACE_FILE": str(trace_path),
+        "SERVICE_MODE": a.service_mode,
+        "SUPERVISOR_LOG": str(tmp / "supervisor.log"),
+        "SUPERVISOR_STATUS": str(tmp / "supervisor_status.json"),
+        "SUPERVISOR_REPORT_INTERVAL": "2",
+        "LAYOUT_CACHE": str(tmp / "layout_cache"),  # a cold cache, so start-up includes compiling the layout
+    })
+    config_path = tmp / "config.txt"
+    config_path.write_text("".join(f"{k}={v}\n" for k, v in cfg.items()))
+    env = dict(os.environ, OPTIWASTE_CONFIG=str(config_path), PYTHONUNBUFFERED="1")
+
+    procs, stop = [], threading.Event()
+    def spawn(cmd, log):
+        p = subprocess.Popen(cmd, cwd=BASE, env=env, stdout=open(tmp / log, "w"), stderr=subprocess.STDOUT, start_new_session=True)
+        procs.append(p)
+        return p
+
+    sim = spawn([sys.executable, str(BASE / "scale_sim.py"), "--out", "pty", "--link", str(tmp / "scale"),
+                 "--scenario", a.scenario, "--seed", str(a.seed), "--hz", str(a.hz), "--items", str(a.items),
+                 "--idle", str(a.idle), "--hold", str(a.hold), "--truth", str(tmp / "truth.jsonl")], "scale_sim.log")
+    while not (tmp / "scale").exists() and sim.poll() is None:
+        time.sleep(0.01)
+    if gui:
+        # gui14.py starts the background services (supervisor.py) itself
+        spawn(([xvfb, "-a"] if not os.environ.get("DISPLAY") else []) + [sys.executable, str(BASE / "gui14.py")], "gui.out")
+    else:
+        spawn([sys.executable, str(BASE / "supervisor.py")], "services.out")
+        threading.Thread(target=emulate_gui_saves, args=(trace_path, tmp / "saved", tmp / "upload_queue.txt", tmp / "catalog.db",
+                               cfg.get("DEVICE_NAME", "OptiA1"), stop),
+                         daemon=True).start()
+    print(f"Benchmark: {a.items} items, {a.scenario} scenario at {a.hz:g} Hz, {'GUI' if gui else 'no GUI'}, work dir {tmp}")
+
+    try:
+        sim.wait()
+        deadline = time.monotonic() + a.drain
+        while time.monotonic() < deadline:
+            recs = read_trace(trace_path)
+            stable = sum(r["stage"] == "stable" for r in recs)
+            if stable and sum(r["stage"] == "uploaded" for r in recs) >= stable:
+                break
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        for p in reversed(procs):
+            if p.poll() is None:
+                os.killpg(p.pid, signal.SIGTERM)  # gui14.py shuts down its own children on SIGTERM
+        for p in procs:
+            try: p.wait(timeout=10)
+            except subprocess.TimeoutExpired: os.killpg(p.pid, signal.SIGKILL)
+        endpoint.shutdown()
+        try: os.unlink(cfg["WEIGHT_CHANNEL"])
+        except FileNotFoundError: pass
+
+    truth = read_trace(tmp / "truth.jsonl")
+    records = read_trace(trace_path)
+    items = join_items(records, truth)
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    meta = {"date": datetime.now().isoformat(timespec="seconds"), "git": rev, "gui": gui, "scenario": a.scenario,
+            "seed": a.seed, "hz": a.hz, "items": a.items, "upload_interval": a.upload_interval, "upload_profile": a.upload_profile,
+            "python": platform.python_version(), "machine": platform.machine(),
+            "endpoint": {"requests": endpoint.requests, "bytes": endpoint.bytes},
+            "services": read_status(tmp / "supervisor_status.json"),
+            "startup_s": {r["stage"][4:]: r["since_start"] for r in records if r["stage"] in ("gui_painted", "gui_first_frame")} or None}
+    result = summarize(items, meta)
+    Path(a.out).write_text(json.dumps(result, indent=2) + "\n")
+    baseline = json.loads(Path(a.baseline).read_text()) if a.baseline else None
+    print_report(result, baseline)
+    print(f"Results written to {a.out}")
+    if not a.keep:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if baseline:
+        worse = regressions(result, baseline, a.tolerance)
+        if worse:
+            print(f"p95 regressions beyond {a.tolerance:.0%}: {', '.join(worse)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+# camera_worker.py
+# Camera capture off the Tk thread. A worker thread pulls frames from Picamera2,
+# transforms them into one of three preallocated buffers and publishes the newest;
+# the GUI only blits whatever frame is ready when its timer fires. In dual-stream
+# mode the preview comes from the cheap `lores` stream and full-resolution stills
+# are copied out of the `main` stream of the same request, so the preview never stops.
+import threading, time, logging, math
+import numpy as np
+from frame_ring import FrameRing
+
+
+# ===== Preview Transform =====
+# numpy rot90 k for a clockwise rotation in degrees
+ROT90_K = {0: 0, 90: -1, 180: 2, 270: 1}
+
+
+RGB_FORMATS = ("RGB888", "BGR888", "XRGB8888", "XBGR8888")
+# Picamera2 rounds stream widths down to 32 (YUV420) and heights to 2, and Yuv420ToRgb needs even sizes
+STREAM_ALIGN = (32, 2)
+
+
+def align_up(size, align=STREAM_ALIGN):
+    return tuple(-(-v // a) * a for v, a in zip(size, align))
+
+
+def preview_configuration(picam2, pane_size, rotation=0, fmt="RGB888", fps=30, still_size=None, lores_format="YUV420"):
+    """Preview config whose stream needs no resize once rotated into pane_size.
+
+    The Pi ISP can only flip, so 180 degrees is done by the sensor transform and
+    returns software rotation 0; 90/270 ask for a transposed stream size and leave
+    the rotation to a zero-copy rot90 view. The stream size is rounded up to the
+    alignment the ISP keeps, and the transform crops the margin. With `still_size`, `main` becomes the
+    full-resolution still stream and the preview moves to `lores` (YUV420 is the
+    only lores format a Pi 4 ISP offers). lores is scaled from main's field of
+    view, so it is requested at main's aspect ratio, just covering the pane, and
+    the pane shows its centre. Returns (config, software_rotation)."""
+    w, h = pane_size
+    frame_us = int(1_000_000 / fps)
+    stream = (h, w) if rotation in (90, 270) else (w, h)
+    preview = {"size": align_up(stream), "format": fmt}
+    kwargs = {"main": preview, "controls": {"FrameDurationLimits": (frame_us, frame_us)}}
+    if still_size:
+        mw, mh = still_size
+        lw = align_up((math.ceil(mw * max(stream[0] / mw, stream[1] / mh)), 0))[0]
+        kwargs["main"] = {"size": tuple(still_size), "format": fmt}
+        kwargs["lores"] = dict(preview, size=align_up((lw, math.ceil(lw * mh / mw))), format=lores_format)
+    software_rotation = rotation
+    if rotation == 180:
+        try:
+            from libcamera import Transform
+            kwargs["transform"] = Transform(hflip=1, vflip=1)
+            software_rotation = 0
+        except ImportError:
+            pass
+    config = picam2.create_preview_configuration(**kwargs)
+    if hasattr(picam2, "align_configuration"):
+        picam2.align_configuration(config)  # stream widths may be padded; make_preview_transform crops the excess
+    return config, software_rotation
+
+
+def make_preview_transform(rotation):
+    """transform(frame, out): rotate as a view, centre-crop to out's size, then one copy into out."""
+    k = ROT90_K[rotation % 360]
+    scale = {}  # shapes -> (frame rows, frame columns, row buffer, scaled buffer), built on the first frame
+
+    def scale_plan(shape, oh, ow):
+        # Nearest-neighbour indices of the rotated view, gathered from the unrotated frame: np.take
+        # fills a reused buffer only from a C-contiguous source, which a rot90 view never is
+        fh, fw = (shape[1], shape[0]) if k % 2 else shape[:2]
+        view_r = np.rot90(np.broadcast_to(np.arange(shape[0])[:, None], shape[:2]), k)
+        view_c = np.rot90(np.broadcast_to(np.arange(shape[1]), shape[:2]), k)
+        vr, vc = np.arange(oh) * fh // oh, np.arange(ow) * fw // ow
+        if k % 2:
+            rows, cols = view_r[0, vc], view_c[vr, 0]
+        else:
+            rows, cols = view_r[vr, 0], view_c[0, vc]
+        return (rows, cols, np.empty((len(rows), shape[1]) + shape[2:], np.uint8),
+                np.empty((len(rows), len(cols)) + shape[2:], np.uint8))
+
+    def transform(frame, out):
+        view = np.rot90(frame, k) if k else frame
+        oh, ow = out.shape[:2]
+        fh, fw = view.shape[:2]
+        if fh < oh or fw < ow:
+            # Stream came back smaller than asked for: nearest-neighbour index through reused buffers
+            key = (frame.shape, out.shape)
+            if key not in scale:
+                scale.clear()
+                scale[key] = scale_plan(frame.shape, oh, ow)
+            rows, cols, row_buf, scaled = scale[key]
+            np.take(frame, rows, axis=0, out=row_buf, mode="clip")
+            np.take(row_buf, cols, axis=1, out=scaled, mode="clip")
+            view = scaled.swapaxes(0, 1) if k % 2 else scaled
+        else:
+            y, x = (fh - oh) // 2, (fw - ow) // 2
+            view = view[y:y + oh, x:x + ow]
+        np.copyto(out[..., :3], view[..., :3])  # an RGBA out keeps its precomposited alpha
+
+    return transform
+
+
+class Yuv420ToRgb:
+    """Full-range BT.601 YUV420 (I420, as Picamera2 maps it: (h*3/2, stride)) to RGB into a reused buffer.
+
+    Chroma terms are computed once per 2x2 block and broadcast onto the luma. With `crop`, only
+    that centred (w, h) window is converted, e.g. the part of a wider stream the pane shows."""
+
+    def __init__(self, size, crop=None):
+        cw, ch = crop or size
+        w, h = min(cw, size[0]) & ~1, min(ch, size[1]) & ~1  # chroma is subsampled 2x2
+        self.full_h, self.x0, self.y0 = size[1], (size[0] - w) // 2 & ~1, (size[1] - h) // 2 & ~1
+        self.w, self.h = w, h
+        self.out = np.empty((h, w, 3), np.uint8)
+        self.acc = np.empty((h // 2, 2, w // 2, 2), np.int32)
+        self.chroma = [np.empty((h // 2, 1, w // 2, 1), np.int32) for _ in range(3)]
+        self.tmp = np.empty((h // 2, 1, w // 2, 1), np.int32)
+
+    def __call__(self, yuv):
+        w, h, fh, x0, y0 = self.w, self.h, self.full_h, self.x0, self.y0
+        stride = yuv.shape[1]
+        y = yuv[y0:y0 + h, x0:x0 + w].reshape(h // 2, 2, w // 2, 2)
+        cy, cx = slice(y0 // 2, (y0 + h) // 2), slice(x0 // 2, (x0 + w) // 2)
+        u = yuv[fh:fh + fh // 4].reshape(fh // 2, stride // 2)[cy, cx].reshape(h // 2, 1, w // 2, 1)
+        v = yuv[fh + fh // 4:fh + fh // 2].reshape(fh // 2, stride // 2)[cy, cx].reshape(h // 2, 1, w // 2, 1)
+        r, g, b = self.chroma
+        # 16.16 fixed point: 1.402, 0.344136, 0.714136, 1.772
+        np.subtract(v, 128, out=r, dtype=np.int32); np.multiply(r, 91881, out=r)
+        np.subtract(u, 128, out=b, dtype=np.int32); np.multiply(b, 116130, out=b)
+        np.subtract(u, 128, out=g, dtype=np.int32); np.multiply(g, -22554, out=g)
+        np.subtract(v, 128, out=self.tmp, dtype=np.int32); np.multiply(self.tmp, -46802, out=self.tmp)
+        np.add(g, self.tmp, out=g)
+        out = self.out.reshape(h // 2, 2, w // 2, 2, 3)
+        for c, term in enumerate((r, g, b)):
+            np.right_shift(term, 16, out=self.tmp)
+            np.add(y, self.tmp, out=self.acc, dtype=np.int32)
+            np.clip(self.acc, 0, 255, out=self.acc)
+            out[..., c] = self.acc
+        return self.out
+
+
+class FrameBuffer:
+    """Triple buffer: the writer fills `back`, publish() swaps it with `ready`, latest() swaps `ready` with `front`.
+
+    With an RGBA shape, `alpha` (e.g. the rounded-corner mask) is written into every slot once here;
+    transforms only touch the colour channels, so the mask is never reapplied per frame."""
+
+    def __init__(self, shape, dtype=np.uint8, count=3, alpha=None):
+        self.slots = [np.zeros(shape, dtype) for _ in range(count)]
+        if alpha is not None:
+            for slot in self.slots:
+                slot[..., 3] = alpha
+        self.back, self.ready, self.front = 0, 1, 2
+        self.fresh, self.seq = False, 0
+        self.lock = threading.Lock()
+        self.published = self.consumed = self.dropped = 0
+
+    def back_buffer(self):
+        return self.slots[self.back]
+
+    def publish(self):
+        with self.lock:
+            if self.fresh:
+                self.dropped += 1  # previous frame was never shown
+            self.back, self.ready = self.ready, self.back
+            self.fresh = True
+            self.seq += 1
+            self.published += 1
+
+    def latest(self):
+        """Newest unseen frame, or None. The returned array stays valid until the next call."""
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.ready, self.front = self.front, self.ready
+            self.fresh = False
+            self.consumed += 1
+            return self.slots[self.front]
+
+    def current(self):
+        """Frame most recently returned by latest() (may be the blank initial buffer)."""
+        return self.slots[self.front]
+
+
+class FrameStats:
+    """Counters sampled periodically to report capture/render/drop rates."""
+
+    def __init__(self):
+        self.t0, self.last = time.monotonic(), (0, 0, 0)
+
+    def rates(self, buf):
+        now = time.monotonic()
+        cur = (buf.published, buf.consumed, buf.dropped)
+        dt = max(now - self.t0, 1e-6)
+        rates = tuple((c - l) / dt for c, l in zip(cur, self.last))
+        self.t0, self.last = now, cur
+        return rates
+
+
+class PreviewGovernor:
+    """Picks the preview rate: full rate while the station is in use, a few fps once idle.
+
+    Activity is an interrupt, scale movement beyond `weight_delta`, or an explicit
+    activity() call. If the measured render cost (EMA) exceeds `budget` of the frame
+    interval, the interval is stretched so rendering never eats the whole Tk loop."""
+
+    def __init__(self, active_fps=30, idle_fps=4, idle_after=20.0, weight_delta=0.02, budget=0.5):
+        self.active_fps, self.idle_fps, self.idle_after = active_fps, idle_fps, idle_after
+        self.weight_delta, self.budget = weight_delta, budget
+        self.last_activity, self.last_weight, self.cost = time.monotonic(), None, 0.0
+
+    def activity(self):
+        self.last_activity = time.monotonic()
+
+    def weight(self, w):
+        if self.last_weight is None or abs(w - self.last_weight) > self.weight_delta:
+            if self.last_weight is not None:
+                self.activity()
+            self.last_weight = w
+
+    def render_cost(self, seconds):
+        self.cost = seconds if self.cost == 0.0 else 0.8 * self.cost + 0.2 * seconds
+
+    @property
+    def idle(self):
+        return time.monotonic() - self.last_activity >= self.idle_after
+
+    def fps(self):
+        """Target frame rate for the camera; the render rate may be lower if backed off."""
+        return self.idle_fps if self.idle else self.active_fps
+
+    def interval_ms(self):
+        interval = 1.0 / self.fps()
+        return max(1, int(1000 * max(interval, self.cost / self.budget)))
+
+
+class Selection:
+    """A pending best-frame capture: resolves once the scene settles after `trigger` or at `deadline`."""
+
+    def __init__(self, trigger, pre_trigger, window, settle_frames, motion_threshold, callback, on_cancel=None, min_settle=0.3):
+        self.trigger, self.since = trigger, trigger - pre_trigger
+        self.deadline, self.earliest = trigger + window, trigger + min_settle
+        self.settle_frames, self.motion_threshold = settle_frames, motion_threshold
+        self.callback, self.on_cancel = callback, on_cancel
+
+    def ready(self, ring, now):
+        # Not before min_settle: a hand that pauses for a couple of frames while letting go is not a settled scene
+        return now >= self.deadline or (now >= self.earliest and ring.settled(self.trigger, self.settle_frames, self.motion_threshold))
+
+
+class CaptureWorker(threading.Thread):
+    """Captures in a loop and writes transform(frame, out) into the frame buffer.
+
+    Pass the Picamera2 configuration in use: if it has a `lores` stream the preview
+    is taken from it and stills come from `main` at full resolution. While
+    `ring_enabled`, still-stream frames are also kept in a FrameRing at `ring_fps`
+    so capture_best() can look back before the trigger."""
+
+    def __init__(self, picam2, shape, transform, alpha=None, config=None, ring_frames=6, ring_fps=10, preview_crop=None):
+        super().__init__(daemon=True, name="capture-worker")
+        self.picam2, self.transform = picam2, transform
+        self.buffer = FrameBuffer(shape, alpha=alpha)
+        self.stats = FrameStats()
+        self.running = True
+        self.errors = 0
+        lores = (config or {}).get("lores")
+        self.dual = bool(lores)
+        # preview_crop: the stream-oriented (w, h) the transform keeps, so YUV outside it is never converted
+        self.convert = Yuv420ToRgb(lores["size"], preview_crop) if lores and lores["format"] not in RGB_FORMATS else None
+        self.ring = FrameRing(ring_frames)
+        self.ring_interval, self.ring_enabled = 1.0 / ring_fps, True
+        self.selection = None
+        self.selection_lock = threading.Lock()
+
+    def capture_best(self, trigger, callback, pre_trigger=0.3, window=1.5, settle_frames=2, motion_threshold=2.0, on_cancel=None,
+                     min_settle=0.3):
+        """callback(frame) is called on this thread with a private copy of the best still-stream frame
+        from the trigger on (from `trigger - pre_trigger` if nothing after it is still), as soon as the
+        scene has settled, but not before `min_settle`, or `window` has passed.
+        A capture still pending when the next one is requested is given up: its on_cancel() is called
+        on the caller's thread."""
+        with self.selection_lock:
+            replaced = self.selection
+            self.selection = Selection(trigger, pre_trigger, window, settle_frames, motion_threshold, callback, on_cancel, min_settle)
+        if replaced is not None:
+            logging.warning(f"Capture triggered {replaced.trigger:.2f} superseded before a frame was chosen")
+            if replaced.on_cancel:
+                replaced.on_cancel()
+
+    def run(self):
+        while self.running:
+            try:
+                if self.dual:
+                    self._capture_dual()
+                else:
+                    frame = self.picam2.capture_array()
+                    self.transform(frame, self.buffer.back_buffer())
+                    self._still_frame(frame, time.monotonic())
+                self.buffer.publish()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Frame capture failed: {e}")
+                time.sleep(0.1)
+
+    def _capture_dual(self):
+        from picamera2 import MappedArray
+        request = self.picam2.capture_request()
+        try:
+            now = time.monotonic()
+            with MappedArray(request, "lores") as m:
+                # Mapped in place; the only copy is the transform into the frame buffer
+                frame = self.convert(m.array) if self.convert else m.array
+                self.transform(frame, self.buffer.back_buffer())
+            if self._wants_still(now):
+                with MappedArray(request, "main") as m:
+                    self._still_frame(m.array, now)
+        finally:
+            request.release()
+
+    def _wants_still(self, now):
+        return self.selection is not None or (self.ring_enabled and now - self.ring.t[self.ring.head] >= self.ring_interval)
+
+    def _still_frame(self, frame, now):
+        if not self._wants_still(now):
+            return
+        self.ring.push(frame, now)
+        with self.selection_lock:
+            sel = self.selection
+            if sel is None or not sel.ready(self.ring, now):
+                return
+            self.selection = None
+        i = self.ring.best(sel.since, sel.motion_threshold, after=sel.trigger)
+        if i is None:
+            # Nothing in the ring since the trigger (e.g. it was off while idle): take the frame just captured
+            logging.warning(f"No ring frame since the trigger, using the current frame after {now - sel.trigger:.2f}s")
+            sel.callback(frame.copy())
+            return
+        logging.info(f"Best frame {now - self.ring.t[i]:.2f}s old, {self.ring.t[i] - sel.trigger:+.2f}s from trigger "
+                     f"(sharpness {self.ring.sharp[i]:.0f}, motion {self.ring.motion[i]:.1f}), chosen after {now - sel.trigger:.2f}s")
+        sel.callback(self.ring.frames[i].copy())
+
+    def set_fps(self, fps):
+        # Lower sensor frame rate means capture_array() blocks longer: fewer wake-ups and less ISP work
+        frame_us = int(1_000_000 / fps)
+        self.picam2.set_controls({"FrameDurationLimits": (frame_us, frame_us)})
+
+    def stop(self):
+        self.running = False
+
+    def report(self):
+        captured, rendered, dropped = self.stats.rates(self.buffer)
+        return f"captured {captured:.1f} fps, rendered {rendered:.1f} fps, dropped {dropped:.1f} fps"
+
+# ===== Tk Blitting =====
+def blittable_image(mode, size):
+    """PIL image backed by one contiguous block, which ImageTk.PhotoImage.paste() blits without a conversion copy.
+
+    Pillow has no public constructor for that, so this relies on the internal Image.core.new_block and
+    checks the result the way paste() does; with any other Pillow it says so once and uses a plain image."""
+    import PIL
+    from PIL import Image
+    try:
+        image = Image.Image()._new(Image.core.new_block(mode, size))
+        if image.im.isblock():
+            return image
+    except (AttributeError, TypeError, ValueError):
+        pass
+    logging.warning(f"Pillow {PIL.__version__} offers no single-block image: PhotoImage.paste() will copy every preview frame once more")
+    return Image.new(mode, size)
+
+
+class PreviewSurface:
+    """One persistent RGBA image and one Tk PhotoImage, both updated in place for every frame.
+
+    Must be created on the Tk thread."""
+
+    def __init__(self, size):
+        from PIL import ImageTk
+        self.image = blittable_image("RGBA", size)
+        self.photo = ImageTk.PhotoImage("RGBA", size)
+
+    def blit(self, frame):
+        # frame is a C-contiguous (H, W, 4) uint8 buffer slot; raw-decoded straight into the block
+        self.image.frombytes(memoryview(frame))
+        self.photo.paste(self.image)
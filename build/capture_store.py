@@ -0,0 +1,66 @@
+# capture_store.py
+# Background persistence for captured images. The Tk thread only enqueues work:
+# each capture is JPEG-encoded once to temp/ and later finalized into saved/ with
+# an atomic rename, never decoded and re-encoded. Jobs run in FIFO order, so a
+# finalize always sees the file its save produced.
+import os, queue, threading, logging, time
+
+PENDING_TIMEOUT = 5  # seconds to wait for a reserved image before giving up on it
+
+
+class PersistWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True, name="persist-worker")
+        self.q = queue.Queue()
+
+    def save(self, image, path, on_done=None):
+        """Encode `image` to `path`. Either a PIL image the caller no longer mutates, or an
+        RGB ndarray (views such as np.rot90 are fine; they are made contiguous here)."""
+        self.q.put(("save", image, path, on_done))
+
+    def save_pending(self, path, on_done=None):
+        """Reserve the next place in the queue for an image produced elsewhere (e.g. the capture
+        thread). Returns fill(image); later jobs such as finalize still run after this save.
+        fill(None) gives the place up at once, instead of after PENDING_TIMEOUT."""
+        slot = queue.Queue(maxsize=1)
+        self.q.put(("save", slot, path, on_done))
+        return slot.put
+
+    def finalize(self, temp_path, final_path, on_done=None):
+        """Move an already-encoded capture to its final name."""
+        self.q.put(("finalize", temp_path, final_path, on_done))
+
+    def stop(self):
+        self.q.put(None)
+
+    def run(self):
+        while True:
+            job = self.q.get()
+            if job is None:
+                break
+            kind, a, b, on_done = job
+            t0 = time.perf_counter()
+            try:
+                if kind == "save":
+                    # Write under a temporary name so a half-written JPEG is never visible as a capture
+                    part = f"{b}.part"
+                    if isinstance(a, queue.Queue):
+                        a = a.get(timeout=PENDING_TIMEOUT)
+                        if a is None:
+                            logging.warning(f"Persist save cancelled for {b}")
+                            continue
+                    if not hasattr(a, "save"):
+                        from PIL import Image
+                        import numpy as np
+                        a = Image.fromarray(np.ascontiguousarray(a))
+                    a.save(part, "JPEG")
+                    os.replace(part, b)
+                else:
+                    os.replace(a, b)
+                logging.info(f"Persist {kind} {b} in {(time.perf_counter() - t0) * 1000:.1f} ms")
+                if on_done:
+                    on_done(b)
+            except Exception as e:
+                logging.error(f"Persist {kind} failed for {b}: {e}")
+            finally:
+                self.q.task_done()
@@ -0,0 +1,141 @@
+# catalog.py
+# Capture catalog shared by gui14.py (writes captures as they are taken and saved)
+# and fileupload.py (reads pending captures, records upload results). SQLite in
+# WAL mode, so the GUI's writes never wait on the uploader's reads; every lookup
+# goes through the primary key or an index, so cost stays O(log n) however many
+# images have been shipped. The capture id is the monotonic primary key.
+import sqlite3, threading, time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    device        TEXT NOT NULL,
+    captured_at   REAL NOT NULL,              -- unix time of the trigger
+    stable_at     REAL,                       -- unix time the stable weight was logged
+    weight        REAL,                       -- kg, full precision from the stability script
+    predicted     INTEGER NOT NULL DEFAULT 0, -- 1 if the weight came from the settle estimator
+    stability_ref TEXT,                       -- "<stability log>:<byte offset>" of this item's samples
+    path          TEXT UNIQUE,                -- path relative to the save folder (date shard / file name)
+    state         TEXT NOT NULL DEFAULT 'capturing',  -- capturing, saved, uploaded, failed, missing, evicted, abandoned
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    uploaded_at   REAL,
+    last_error    TEXT
+);
+CREATE INDEX IF NOT EXISTS captures_state ON captures(state, id);
+CREATE INDEX IF NOT EXISTS captures_time ON captures(captured_at);
+"""
+# Applied in order to bring an older database up to date; index i upgrades to user_version i+2
+MIGRATIONS = [
+    """
+    ALTER TABLE captures ADD COLUMN next_attempt REAL;  -- unix time a failed upload may be retried
+    CREATE INDEX IF NOT EXISTS captures_retry ON captures(state, next_attempt);
+    """,
+    """
+    ALTER TABLE captures ADD COLUMN spool_level INTEGER NOT NULL DEFAULT 0;  -- 0 as captured, 1 downscaled, 2 thumbnail only
+    """,
+]
+SCHEMA_VERSION = 1 + len(MIGRATIONS)
+
+
+class Catalog:
+    def __init__(self, path):
+        # One connection shared by the caller's threads (Tk and persist worker in the GUI), serialised by a lock
+        self.db = sqlite3.connect(str(path), timeout=5, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent on power loss; only the last commits can roll back
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                self.db.executescript(SCHEMA)
+            for script in MIGRATIONS[max(0, version - 1):]:
+                self.db.executescript(script)
+            if version < SCHEMA_VERSION:
+                self.db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _exec(self, sql, args=(), fetch=None):
+        with self.lock:
+            cur = self.db.execute(sql, args)
+            return cur.fetchone() if fetch == "one" else cur.fetchall() if fetch == "all" else cur
+
+    def new_capture(self, device, captured_at=None):
+        """Returns the new capture id."""
+        return self._exec("INSERT INTO captures (device, captured_at) VALUES (?, ?)",
+                          (device, captured_at or time.time())).lastrowid
+
+    def set_path(self, capture_id, path):
+        """Claim the final path before the file is renamed there, so a sweep that sees the file finds this row."""
+        self._exec("UPDATE captures SET path=? WHERE id=?", (path, capture_id))
+
+    def mark_saved(self, capture_id, path, weight, stable_at=None, predicted=False, stability_ref=None):
+        self._exec("UPDATE captures SET state='saved', path=?, weight=?, stable_at=?, predicted=?, stability_ref=? WHERE id=?",
+                   (path, weight, stable_at or time.time(), int(predicted), stability_ref, capture_id))
+
+    def mark_uploaded(self, capture_id):
+        self._exec("UPDATE captures SET state='uploaded', uploaded_at=?, attempts=attempts+1, last_error=NULL, next_attempt=NULL WHERE id=?",
+                   (time.time(), capture_id))
+
+    def mark_failed(self, capture_id, error, next_attempt=None):
+        self._exec("UPDATE captures SET state='failed', attempts=attempts+1, last_error=?, next_attempt=? WHERE id=?",
+                   (str(error)[:500], next_attempt, capture_id))
+
+    def mark_missing(self, capture_id):
+        """The saved file disappeared before it could be uploaded; stop offering it as pending."""
+        self._exec("UPDATE captures SET state='missing' WHERE id=?", (capture_id,))
+
+    def capturing(self):
+        return self._exec("SELECT * FROM captures WHERE state='capturing'", fetch="all")
+
+    def mark_recovered(self, capture_id, weight=None):
+        """A capture a previous run renamed into place but stopped before mark_saved(): pending upload again."""
+        self._exec("UPDATE captures SET state='saved', weight=IFNULL(weight, ?), stable_at=IFNULL(stable_at, ?) "
+                   "WHERE id=? AND state='capturing'", (weight, time.time(), capture_id))
+
+    def abandon_capturing(self):
+        """Captures a previous run started but never saved (its temp file is gone); returns how many."""
+        return self._exec("UPDATE captures SET state='abandoned' WHERE state='capturing'").rowcount
+
+    def mark_abandoned(self, capture_id, reason=None):
+        """A capture that will never be saved, e.g. superseded before its frame was chosen."""
+        self._exec("UPDATE captures SET state='abandoned', last_error=? WHERE id=? AND state='capturing'", (reason, capture_id))
+
+    def set_spool_level(self, capture_id, level):
+        self._exec("UPDATE captures SET spool_level=? WHERE id=?", (level, capture_id))
+
+    def mark_evicted(self, capture_id):
+        """Deleted unsent to keep the spool within its disk budget."""
+        self._exec("UPDATE captures SET state='evicted', next_attempt=NULL WHERE id=?", (capture_id,))
+
+    def get(self, capture_id):
+        return self._exec("SELECT * FROM captures WHERE id=?", (capture_id,), "one")
+
+    def by_path(self, name):
+        return self._exec("SELECT * FROM captures WHERE path=?", (name,), "one")
+
+    def due(self, now=None, limit=500):
+        """Pending captures whose retry time has come (new ones have none), oldest first."""
+        return self._exec("SELECT * FROM captures WHERE state='saved' OR (state='failed' AND IFNULL(next_attempt, 0) <= ?) "
+                          "ORDER BY id LIMIT ?", (now or time.time(), limit), "all")
+
+    def oldest_pending(self, below_level=None, limit=100):
+        """Saved or failed captures oldest first, optionally only those stored above a spool level."""
+        return self._exec("SELECT * FROM captures WHERE state IN ('saved', 'failed') AND spool_level < ? ORDER BY captured_at, id LIMIT ?",
+                          (99 if below_level is None else below_level, limit), "all")
+
+    def next_retry(self):
+        """Earliest scheduled retry time, or None if nothing is waiting."""
+        return self._exec("SELECT MIN(next_attempt) FROM captures WHERE state='failed'", fetch="one")[0]
+
+    def add_legacy(self, path, device, captured_at, weight, state):
+        """Record a capture that predates the catalog (file name metadata only)."""
+        self._exec("INSERT OR IGNORE INTO captures (device, captured_at, weight, path, state) VALUES (?, ?, ?, ?, ?)",
+                   (device, captured_at, weight, path, state))
+        return self.by_path(path)
+
+    def counts(self):
+        return dict(self._exec("SELECT state, COUNT(*) FROM captures GROUP BY state", fetch="all"))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,147 @@
+# file_watcher.py
+# Wakes callers only when a watched file changes. Uses inotify on Linux and falls
+# back to comparing stat() results at a fixed interval everywhere else. With
+# inotify each file is watched for writes, and its parent directory only for
+# names appearing or going away (so rename-replaced files are still seen and get a
+# new file watch). Writes to the other files in that directory, such as logs and
+# the SQLite WAL, wake nobody.
+import ctypes, ctypes.util, os, select, struct, time
+from pathlib import Path
+
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_IGNORED = 0x2, 0x8, 0x80, 0x100, 0x200, 0x8000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+DIR_MASK = IN_MOVED_TO | IN_CREATE | IN_DELETE
+FILE_MASK = IN_MODIFY | IN_CLOSE_WRITE
+EVENT = struct.Struct("iIII")
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+class FileWatcher:
+    """Watch a set of files. changed() drains pending changes without blocking, wait() blocks for one."""
+
+    def __init__(self, paths, interval=0.2):
+        self.paths = {Path(p).resolve() for p in paths}
+        self.interval, self.fd, self._wds, self._files = interval, None, {}, {}  # wd -> directory, wd -> file
+        self._stats = {p: self._stat(p) for p in self.paths}
+        if _libc is not None:
+            self._init_inotify()
+
+    def _init_inotify(self):
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return
+        for d in {p.parent for p in self.paths}:
+            wd = _libc.inotify_add_watch(fd, str(d).encode(), DIR_MASK)
+            if wd < 0:
+                os.close(fd)
+                return
+            self._wds[wd] = d
+        self.fd = fd
+        for p in self.paths:
+            self._watch_file(p)
+
+    def _watch_file(self, path):
+        # Follows the inode: a file replaced by rename needs a new watch, added when its name reappears
+        wd = _libc.inotify_add_watch(self.fd, str(path).encode(), FILE_MASK)
+        if wd >= 0:
+            self._files[wd] = path
+
+    @property
+    def native(self):
+        return self.fd is not None
+
+    def fileno(self):
+        return self.fd
+
+    @staticmethod
+    def _stat(p):
+        try:
+            st = os.stat(p)
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    def changed(self):
+        if self.fd is None:
+            return self._poll()
+        hits = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            off = 0
+            while off < len(buf):
+                wd, mask, _, length = EVENT.unpack_from(buf, off)
+                name = buf[off + EVENT.size:off + EVENT.size + length].rstrip(b"\0").decode(errors="replace")
+                off += EVENT.size + length
+                if wd in self._files:
+                    if mask & IN_IGNORED:
+                        del self._files[wd]  # the inode is gone (replaced or deleted)
+                    else:
+                        hits.add(self._files[wd])
+                    continue
+                path = self._wds.get(wd, Path()) / name
+                if path in self.paths:
+                    hits.add(path)
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch_file(path)
+        return hits
+
+    def _poll(self):
+        hits = set()
+        for p in self.paths:
+            st = self._stat(p)
+            if st != self._stats[p]:
+                self._stats[p] = st
+                hits.add(p)
+        return hits
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self.fd is not None:
+                if select.select([self.fd], [], [], remaining)[0]:
+                    hits = self.changed()
+                    if hits:
+                        return hits
+                    continue
+                return set()
+            hits = self._poll()
+            if hits or remaining == 0.0:
+                return hits
+            time.sleep(self.interval if remaining is None else min(self.interval, remaining))
+
+    def attach_tk(self, win, callback):
+        """Call callback(changed_paths) on the Tk thread whenever a watched file changes."""
+        if self.fd is not None and hasattr(win, "tk") and hasattr(win.tk, "createfilehandler"):
+            import tkinter
+            def on_readable(*_):
+                hits = self.changed()
+                if hits:
+                    callback(hits)
+            win.tk.createfilehandler(self.fd, tkinter.READABLE, on_readable)
+            return
+        def poll():
+            hits = self._poll()
+            if hits:
+                callback(hits)
+            win.after(int(self.interval * 1000), poll)
+        win.after(int(self.interval * 1000), poll)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -1,141 +1,309 @@
 #!/usr/bin/env python3
-import requests, os, logging, time
+import requests, os, logging, time, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from pathlib import Path
+from stage_trace import stage_trace, config_file, install_sigterm
+from file_watcher import FileWatcher
+from upload_queue import QueueReader
+from catalog import Catalog
+from upload_scheduler import CircuitBreaker, retry_delay
+from transcode import Profile, Prepared, Transcoder
+from spool import Spool
+from datetime import datetime
+from contextlib import nullcontext
 
-API_URL = "https://forgevision.ai/opti/uploadimageapi/upload_image.php"
 BASE = Path(__file__).parent
-cfg = {k.strip():v.strip() for k,v in(line.split("=",1) for line in open(BASE/"config.txt") if "=" in line)}
-UPLOAD_LOG = BASE / "upload_log.txt"
-UPLOAD_INTERVAL, MAX_RETRIES = 600, 3
+cfg = {k.strip():v.strip() for k,v in(line.split("=",1) for line in open(config_file(BASE/"config.txt")) if "=" in line)}
+API_URL = cfg.get("UPLOAD_URL", "https://forgevision.ai/opti/uploadimageapi/upload_image.php")
+UPLOAD_LOG = BASE / cfg.get("UPLOAD_LOG", "upload_log.txt")  # pre-catalog record of uploads, imported once
+UPLOAD_QUEUE = BASE / cfg.get("UPLOAD_QUEUE", "upload_queue.txt")  # appended by the GUI as captures are finalized
+UPLOAD_INTERVAL = int(cfg.get("UPLOAD_INTERVAL", 600))  # the sweep is only a reconciliation pass now
+trace = stage_trace(cfg)
+UPLOAD_WORKERS = int(cfg.get("UPLOAD_WORKERS", 4))
+UPLOAD_PER_HOST = int(cfg.get("UPLOAD_PER_HOST", UPLOAD_WORKERS))  # max open connections to one host
+TIMEOUT = (float(cfg.get("UPLOAD_CONNECT_TIMEOUT", 5)), float(cfg.get("UPLOAD_READ_TIMEOUT", 30)))
+RETRY_BASE, RETRY_MAX = float(cfg.get("UPLOAD_RETRY_BASE", 10)), float(cfg.get("UPLOAD_RETRY_MAX", 3600))  # per-image backoff, seconds
+breaker = CircuitBreaker(API_URL, BASE / cfg.get("UPLOAD_STATUS", "upload_status.json"),
+                         failures=int(cfg.get("UPLOAD_BREAKER_FAILURES", 3)), probe_base=float(cfg.get("UPLOAD_PROBE_BASE", 5)),
+                         probe_cap=float(cfg.get("UPLOAD_PROBE_MAX", 300)), probe_timeout=TIMEOUT[0])
+
+def make_session():
+    # One keep-alive pool shared by all workers: TCP/TLS handshakes are paid once per connection, not per image.
+    # pool_block makes workers wait for a free connection instead of opening more than UPLOAD_PER_HOST.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPLOAD_PER_HOST, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+session = make_session()
+UPLOAD_PROFILE = Profile.parse(cfg.get("UPLOAD_PROFILE", "original"))  # e.g. "max_dim=1600 quality=80 thumb=320"
+UPLOAD_CACHE = BASE / cfg.get("UPLOAD_CACHE", "upload_cache")
+TRANSCODE_WORKERS = int(cfg.get("TRANSCODE_WORKERS", 2))
+transcoder = None  # started by run_upload_service() when a profile is configured
+service_stop = threading.Event()  # run_upload_service()'s stop flag
 IMAGE_DIR, DEVICE_NAME = BASE / cfg.get("SAVE_FOLDER", "saved"), cfg.get("DEVICE_NAME", "Opti02")
-logging.basicConfig(filename=str(BASE/"uploader.log"), level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+catalog = Catalog(BASE / cfg.get("CATALOG", "catalog.db"))
+IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+spool = Spool(IMAGE_DIR, catalog, max_bytes=float(cfg.get("SPOOL_MAX_MB", 2048)) * 1e6, max_files=int(cfg.get("SPOOL_MAX_FILES", 20000)),
+              min_free=float(cfg.get("SPOOL_MIN_FREE_MB", 512)) * 1e6, policy=cfg.get("SPOOL_EVICTION", "downscale,thumbnail,oldest"),
+              downscale=cfg.get("SPOOL_DOWNSCALE", "max_dim=1280 quality=70"), thumbnail=cfg.get("SPOOL_THUMBNAIL", "max_dim=320 quality=60"))
+SPOOL_CHECK_INTERVAL = float(cfg.get("SPOOL_CHECK_INTERVAL", 60))
+logging.basicConfig(filename=str(BASE/cfg.get("UPLOADER_LOG", "uploader.log")), level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-def get_uploaded_files():
+def parse_legacy_name(name):
+    """(device, unix time, weight) from a pre-catalog name like OptiA1_18-24-58_2025-08-25_0x92.jpg, or None."""
+    parts = Path(name).stem.split("_")
+    if len(parts) not in (4, 5):  # catalog-era names carry the capture id as a fifth part
+        return None
+    device_name, time_part, date_part, weight_part = parts[:4]
     try:
-        # Ensure upload log file exists
-        UPLOAD_LOG.parent.mkdir(parents=True, exist_ok=True)
-        if not UPLOAD_LOG.exists():
-            UPLOAD_LOG.touch()
-            logging.info("Created upload_log.txt file")
-            
-        with open(UPLOAD_LOG, 'r') as f: 
-            return set(line.strip() for line in f if line.strip())
-    except Exception as e:
-        logging.error(f"Error reading upload log: {str(e)}")
-        return set()
+        t = datetime.strptime(f"{date_part} {time_part}", "%Y-%m-%d %H-%M-%S").timestamp()
+        return device_name, t, float(weight_part.replace("x", "."))
+    except ValueError:
+        return None
+
+def import_upload_log():
+    # One-off migration: names in the old upload_log.txt become 'uploaded' catalog rows
+    if not UPLOAD_LOG.exists():
+        return
+    n = 0
+    with open(UPLOAD_LOG) as f:
+        for line in f:
+            name = line.strip()
+            if name:
+                device_name, t, weight = parse_legacy_name(name) or (DEVICE_NAME, 0, None)
+                catalog.add_legacy(name, device_name, t, weight, "uploaded")
+                n += 1
+    UPLOAD_LOG.rename(UPLOAD_LOG.with_name(UPLOAD_LOG.name + ".imported"))
+    logging.info(f"Imported {n} entries from {UPLOAD_LOG.name} into the catalog")
 
-def log_uploaded_file(filename):
+def catalog_row(file_path):
+    """Catalog row for a file in the image folder; files from before the catalog get one from their name."""
+    rel = file_path.relative_to(IMAGE_DIR).as_posix()  # "<date shard>/<name>", or just the name for pre-shard files
+    row = catalog.by_path(rel)
+    if row is None:
+        meta = parse_legacy_name(file_path.name)
+        if meta is None:
+            logging.error(f"Invalid filename format: {rel}")
+            return None
+        row = catalog.add_legacy(rel, *meta, "saved")
+    return row
+
+def prepare(file_path):
+    """Re-encode for upload per UPLOAD_PROFILE (cached by content hash), or the file as saved without a profile."""
+    size = file_path.stat().st_size
+    if transcoder is None:
+        return Prepared(file_path, bytes_in=size, bytes_out=size)
     try:
-        with open(UPLOAD_LOG, 'a') as f: 
-            f.write(f"{filename}\n")
-            logging.info(f"Logged uploaded file: {filename}")
+        p = transcoder.prepare(file_path)
     except Exception as e:
-        logging.error(f"Error logging uploaded file: {str(e)}")
+        logging.error(f"Transcoding failed for {file_path.name}, uploading it as saved: {str(e)}")
+        return Prepared(file_path, bytes_in=size, bytes_out=size)
+    saved = 1 - (p.bytes_out + p.thumb_bytes) / max(p.bytes_in, 1)
+    logging.info(f"Prepared {file_path.name}: {p.bytes_in / 1e3:.0f} kB -> {p.bytes_out / 1e3:.0f} kB"
+                 + (f" + {p.thumb_bytes / 1e3:.0f} kB thumbnail" if p.thumb else "")
+                 + f" ({saved:.0%} saved), " + ("cached" if p.cached else f"{p.cpu * 1000:.0f} ms CPU"))
+    trace.mark("prepared", file_path.name, bytes_in=p.bytes_in, bytes_out=p.bytes_out + p.thumb_bytes, cpu_ms=round(p.cpu * 1000, 1))
+    return p
+
+def upload_file(file_path, row):
+    """One attempt; a failure schedules the next one in the catalog instead of sleeping.
+    Returns the Prepared upload on success, False on failure, None if deferred by the circuit breaker."""
+    file_name = file_path.name
 
-def upload_file_with_retries(file_path):
-    file_name, attempts = file_path.name, 0
-    
     # Check if file still exists
     if not file_path.exists():
         logging.warning(f"File no longer exists: {file_name}")
         return False
-        
-    while attempts < MAX_RETRIES:
-        try:
-            logging.info(f"Attempt {attempts+1} for file: {file_name}")
-            parts = file_name.split("_")
-            if len(parts) != 4: 
-                logging.error(f"Invalid filename format: {file_name}")
-                return False
-                
-            device_name, time_date_part, date_part, weight_part = parts
-            weight = float(weight_part.split(".")[0].replace("x", "."))
-            timestamp = f"{date_part} {':'.join(time_date_part.split('-'))}"
-            
-            with open(file_path, "rb") as image_file:
-                response = requests.post(API_URL, files={"image": image_file}, 
-                                        data={"device_name": device_name, "timestamp": timestamp, "weight": weight}, 
-                                        timeout=30)
-            
-            if response.status_code == 200:
-                logging.info(f"Successfully uploaded {file_name}")
-                log_uploaded_file(file_name)
-                # Delete the file only after successful upload and logging
-                try:
-                    file_path.unlink()
-                    logging.info(f"Deleted uploaded file: {file_name}")
-                except Exception as e:
-                    logging.error(f"Error deleting file {file_name}: {str(e)}")
-                return True
-                
-            logging.warning(f"Upload attempt {attempts+1} failed for {file_name}. Status: {response.status_code}")
-            
-        except Exception as e:
-            logging.error(f"Error during attempt {attempts+1} for {file_name}: {str(e)}")
-        
-        attempts += 1
-        if attempts < MAX_RETRIES: 
-            logging.info(f"Waiting 10 seconds before retry {attempts+1}")
-            time.sleep(10)
-            
-    logging.error(f"All upload attempts failed for {file_name}")
+    if not breaker.allow():
+        return None  # network is down: leave the row as it is, it is picked up again once the breaker closes
+
+    # Metadata comes from the catalog, not from the file name: exact weight, full timestamp
+    timestamp = datetime.fromtimestamp(row["captured_at"]).strftime("%Y-%m-%d %H:%M:%S")
+    data = {"device_name": row["device"], "timestamp": timestamp, "weight": row["weight"]}
+    attempt = row["attempts"] + 1
+    try:
+        prepared = prepare(file_path)
+        logging.info(f"Attempt {attempt} for file: {file_name}")
+        with open(prepared.path, "rb") as image_file, open(prepared.thumb, "rb") if prepared.thumb else nullcontext() as thumb_file:
+            files = {"image": (file_path.stem + prepared.path.suffix, image_file, prepared.mime)}
+            if thumb_file:
+                files["thumbnail"] = (f"{file_path.stem}_thumb{prepared.thumb.suffix}", thumb_file, UPLOAD_PROFILE.mime)
+            response = session.post(API_URL, files=files, data=data, timeout=TIMEOUT)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        breaker.failure()  # the network, not this image: counts towards opening the breaker
+        error = e
+    except Exception as e:
+        breaker.release()
+        error = e
+    else:
+        if response.status_code == 200:
+            breaker.success()
+            logging.info(f"Successfully uploaded {file_name}")
+            trace.mark("uploaded", file_name, bytes=prepared.bytes_out + prepared.thumb_bytes)
+            catalog.mark_uploaded(row["id"])
+            if transcoder is not None:
+                transcoder.discard(prepared)
+            # Delete the file only after successful upload and recording it
+            try:
+                file_path.unlink()
+                logging.info(f"Deleted uploaded file: {file_name}")
+            except Exception as e:
+                logging.error(f"Error deleting file {file_name}: {str(e)}")
+            return prepared
+        breaker.release()  # the server answered, so the link is up even if this image was refused
+        error = f"HTTP {response.status_code}"
+
+    delay = retry_delay(attempt, RETRY_BASE, RETRY_MAX)
+    logging.warning(f"Upload attempt {attempt} failed for {file_name}: {error}. Next attempt in {delay:.0f} s")
+    catalog.mark_failed(row["id"], error, time.time() + delay)
     return False
 
+def upload_batch(items):
+    """Upload (file_path, catalog_row) pairs on UPLOAD_WORKERS threads; a slow or failing image only holds up its own worker.
+    Returns how many were deferred by the circuit breaker."""
+    if not items:
+        return 0
+    t0, done, sent, raw, cpu, deferred = time.monotonic(), 0, 0, 0, 0.0, 0
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload") as pool:
+        futures = {pool.submit(upload_file, f, row): f for f, row in items}
+        for fut in as_completed(futures):
+            # Checked per image: under supervisor.py each check is also the heartbeat of a long batch
+            if service_stop.is_set():
+                for f in futures:
+                    f.cancel()  # not started yet: they stay due in the catalog
+            if fut.cancelled():
+                continue
+            file_path = futures[fut]
+            try:
+                ok = fut.result()
+            except Exception as e:
+                logging.error(f"Unexpected error processing {file_path.name}: {str(e)}")
+                continue
+            if ok:
+                done, sent, raw, cpu = done + 1, sent + ok.bytes_out + ok.thumb_bytes, raw + ok.bytes_in, cpu + ok.cpu
+                logging.info(f"Successfully processed {file_path.name}")
+            elif ok is None:
+                deferred += 1
+    dt = max(time.monotonic() - t0, 1e-6)
+    logging.info(f"Uploaded {done}/{len(items)} images, {sent / 1e6:.2f} MB in {dt:.1f} s: "
+                 f"{done / dt:.2f} img/s, {sent / dt / 1e6:.2f} MB/s ({UPLOAD_WORKERS} workers)"
+                 + (f"; transcoding saved {(raw - sent) / 1e6:.2f} MB ({1 - sent / max(raw, 1):.0%}) for {cpu:.1f} s CPU" if transcoder and done else "")
+                 + (f", {deferred} deferred while offline" if deferred else ""))
+    return deferred
+
+def upload_due(limit=500):
+    """Upload every catalog row whose retry time has come. Returns True if more are due right away."""
+    if not breaker.check():
+        return False  # offline: nothing is attempted until a probe gets through
+    items = []
+    for row in catalog.due(limit=limit):
+        file_path = IMAGE_DIR / row["path"]
+        if file_path.exists():
+            items.append((file_path, row))
+        else:
+            logging.warning(f"Catalog entry {row['id']} has no file: {row['path']}")
+            catalog.mark_missing(row["id"])
+    deferred = upload_batch(items)
+    return len(items) == limit or (deferred > 0 and breaker.state != "open")
+
 def upload_cycle():
+    # Reconciliation: files the catalog does not know become pending rows, then everything due is uploaded
     try:
         IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-        UPLOAD_LOG.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Ensure upload log exists
-        if not UPLOAD_LOG.exists():
-            UPLOAD_LOG.touch()
-            
-        uploaded_files = get_uploaded_files()
-        logging.info(f"Found {len(uploaded_files)} files in upload log")
-        
-        image_files = list(IMAGE_DIR.glob("*.jpg"))
-        logging.info(f"Found {len(image_files)} image files to process")
-        
-        if not image_files:
-            logging.info("No images to upload")
-            return
-            
-        for file_path in image_files:
-            if file_path.name not in uploaded_files:
-                try:
-                    if upload_file_with_retries(file_path):
-                        logging.info(f"Successfully processed {file_path.name}")
-                    else:
-                        logging.warning(f"Failed to process {file_path.name} after retries")
-                except Exception as e:
-                    logging.error(f"Unexpected error processing {file_path.name}: {str(e)}")
-            else:
+        found = 0
+        for file_path in [*IMAGE_DIR.glob("*/*.jpg"), *IMAGE_DIR.glob("*.jpg")]:  # date shards, then pre-shard files
+            row = catalog_row(file_path)
+            if row is None:
+                continue
+            if row["state"] == "uploaded":
                 logging.info(f"File already uploaded: {file_path.name}")
-                # Remove file if it's already in the log (already uploaded)
+                # Remove file if the catalog already has it as uploaded
                 try:
                     file_path.unlink()
                     logging.info(f"Removed already uploaded file: {file_path.name}")
                 except Exception as e:
                     logging.error(f"Error removing file {file_path.name}: {str(e)}")
+            else:
+                found += 1
+        logging.info(f"Sweep found {found} images not yet uploaded; catalog {catalog.counts()}")
+        if transcoder is not None:
+            transcoder.prune()
+        return upload_due()
                 
     except Exception as e:
         logging.error(f"Fatal error in upload cycle: {str(e)}")
         raise
 
-def run_upload_service():
+def upload_queued(reader):
+    # New captures are already pending rows in the catalog; the queue only says "look now".
+    # Entries whose file is gone were already uploaded (e.g. by a sweep) and are simply skipped.
+    names = reader.read()
+    if not names:
+        return False
+    for n in dict.fromkeys(names):
+        file_path = IMAGE_DIR / n
+        if file_path.exists():
+            catalog_row(file_path)
+    logging.info(f"Upload queue: {len(names)} new entries")
+    more = upload_due()
+    reader.commit()  # failed or deferred uploads stay pending in the catalog with their retry time
+    return more
+
+def check_spool():
+    # While offline the spool only grows: degrade or evict the oldest pending captures to stay within budget
+    try:
+        spool.enforce()
+    except Exception as e:
+        logging.error(f"Spool check failed: {str(e)}")
+
+def next_wake(next_sweep, next_spool):
+    """Seconds the service may sleep: until the sweep, the spool check, the next breaker probe or the earliest scheduled retry."""
+    t = min(next_sweep, next_spool) - time.monotonic()
+    if breaker.state == "open":
+        return max(0.0, min(t, breaker.wait_time()))
+    retry = catalog.next_retry()
+    if retry is not None:
+        t = min(t, retry - time.time())
+    return max(0.0, t)
+
+def run_upload_service(stop=None):
+    """Run until `stop` (a threading.Event) is set; supervisor.py runs this in a thread, or it is a script."""
+    global transcoder, service_stop
+    stop = service_stop = stop or threading.Event()
     logging.info("Starting upload service")
-    while True:
+    import_upload_log()
+    if UPLOAD_PROFILE is not None:
+        transcoder = Transcoder(UPLOAD_PROFILE, UPLOAD_CACHE, TRANSCODE_WORKERS)  # as a process: before any upload thread exists
+        logging.info(f"Upload profile {UPLOAD_PROFILE} on {TRANSCODE_WORKERS} worker processes")
+    reader = QueueReader(UPLOAD_QUEUE)
+    watcher = FileWatcher([UPLOAD_QUEUE], interval=0.5)
+    next_sweep = next_spool = time.monotonic()  # reconcile once at start-up, then every UPLOAD_INTERVAL
+    while not stop.is_set():
         try:
-            logging.info("Starting new upload cycle")
-            upload_cycle()
-            logging.info(f"Upload cycle completed. Waiting {UPLOAD_INTERVAL} seconds")
-            time.sleep(UPLOAD_INTERVAL)
+            more = False
+            if time.monotonic() >= next_sweep:
+                logging.info("Starting reconciliation sweep")
+                more = upload_cycle()
+                next_sweep = time.monotonic() + UPLOAD_INTERVAL
+                logging.info(f"Sweep completed. Next in {UPLOAD_INTERVAL} seconds")
+            if time.monotonic() >= next_spool:
+                check_spool()
+                next_spool = time.monotonic() + SPOOL_CHECK_INTERVAL
+            more = upload_queued(reader) or upload_due() or more
+            if not more:
+                watcher.wait(timeout=min(next_wake(next_sweep, next_spool), 1.0))  # wake at least once a second to see stop
         except KeyboardInterrupt:
             logging.info("Upload service stopped by user")
             break
         except Exception as e:
             logging.error(f"Error in upload service: {str(e)}")
-            time.sleep(60)
+            stop.wait(60)
+    watcher.close()
+    if transcoder is not None:
+        transcoder.close()
 
 if __name__ == "__main__":
-    run_upload_service()
\ No newline at end of file
+    run_upload_service(install_sigterm(threading.Event()))
\ No newline at end of file
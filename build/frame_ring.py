@@ -0,0 +1,74 @@
+# frame_ring.py
+# Bounded ring of recent full-resolution frames with timestamps and a per-frame
+# sharpness/motion score, so the capture can pick the best frame around the
+# interrupt instead of grabbing whatever frame exists a fixed second later.
+import numpy as np
+
+SCORE_STEP = 8  # score on every 8th pixel of the green channel: cheap and still tracks focus/blur
+
+
+def downsample(frame, step=SCORE_STEP):
+    return frame[::step, ::step, 1] if frame.ndim == 3 else frame[::step, ::step]
+
+
+def sharpness(small):
+    """Variance of the 4-neighbour Laplacian; motion blur and defocus both lower it."""
+    c = small.astype(np.float32)
+    lap = 4 * c[1:-1, 1:-1] - c[:-2, 1:-1] - c[2:, 1:-1] - c[1:-1, :-2] - c[1:-1, 2:]
+    return float(lap.var())
+
+
+def motion(small, prev):
+    """Mean absolute difference against the previous scored frame, 0-255."""
+    return float(np.abs(small.astype(np.int16) - prev).mean()) if prev is not None else 0.0
+
+
+class FrameRing:
+    def __init__(self, size):
+        self.size = size
+        self.frames, self.smalls = [None] * size, [None] * size
+        self.t = np.full(size, -np.inf)
+        self.sharp = np.zeros(size)
+        self.motion = np.zeros(size)
+        self.head, self.last_small = -1, None
+
+    def push(self, frame, t):
+        """Copy `frame` into the next slot (slots are allocated once, on first use) and score it."""
+        i = self.head = (self.head + 1) % self.size
+        if self.frames[i] is None or self.frames[i].shape != frame.shape:
+            self.frames[i] = np.empty_like(frame)
+        np.copyto(self.frames[i], frame)
+        small = downsample(self.frames[i])
+        if self.smalls[i] is None or self.smalls[i].shape != small.shape:
+            self.smalls[i] = np.empty(small.shape, np.int16)
+        self.t[i], self.sharp[i], self.motion[i] = t, sharpness(small), motion(small, self.last_small)
+        np.copyto(self.smalls[i], small)
+        self.last_small = self.smalls[i]
+        return i
+
+    def recent(self, since):
+        return np.flatnonzero(self.t >= since)
+
+    def settled(self, since, frames, threshold):
+        """True once the last `frames` frames taken after `since` all moved less than `threshold`."""
+        idx = [(self.head - k) % self.size for k in range(frames)]
+        return all(self.t[i] >= since and self.motion[i] < threshold for i in idx)
+
+    def best(self, since, motion_threshold, after=None, motion_weight=0.2):
+        """Index of the best frame at or after `since`, or None.
+
+        The sharpest frame among those that moved less than `motion_threshold` wins, taken from
+        `after` (the trigger) on; frames between `since` and `after` are only used when none after
+        it is still, so a sharp frame of the empty tray cannot beat the item. If the hand never
+        left the scene, sharpness is traded off against motion instead, again after `after` first."""
+        idx = self.recent(since)
+        if idx.size == 0:
+            return None
+        late = idx[self.t[idx] >= after] if after is not None else idx
+        for group in (late, idx):
+            still = group[self.motion[group] < motion_threshold]
+            if still.size:
+                return int(still[np.argmax(self.sharp[still])])
+        group = late if late.size else idx
+        score = self.sharp[group] / (1.0 + motion_weight * self.motion[group])
+        return int(group[np.argmax(score)])
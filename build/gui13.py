@@ -2,9 +2,11 @@ import subprocess, sys, threading, time, os, logging, signal, platform
 from pathlib import Path
 from tkinter import Tk, Canvas, PhotoImage
 from PIL import Image, ImageTk, ImageDraw
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from picamera2 import Picamera2  # Changed to Picamera2 for Arducam
+from camera_worker import preview_configuration, make_preview_transform
 
 # ===== Load Config =====
 def load_config(file):
@@ -109,11 +111,14 @@ ImageDraw.Draw(right_mask).rounded_rectangle((0, 0, RIGHT_PANE_W, RIGHT_PANE_H),
 picam2 = None
 camera_ready = False
 
+preview_transform = None
+
 def init_cam():
-    global picam2, camera_ready
+    global picam2, camera_ready, preview_transform
     try:
         picam2 = Picamera2()
-        config = picam2.create_preview_configuration(main={"size": (LEFT_PANE_W, LEFT_PANE_H), "format": "RGB888"})
+        config, software_rotation = preview_configuration(picam2, (LEFT_PANE_W, LEFT_PANE_H), 90 if ROTATE_RIGHT_90 else 0)
+        preview_transform = make_preview_transform(software_rotation)
         picam2.configure(config)
         picam2.start()
         camera_ready = True
@@ -128,12 +133,9 @@ def capture_frame():
         return False
     try:
         frame = picam2.capture_array()
-        pil_im = Image.fromarray(frame)
-        if ROTATE_RIGHT_90:
-            pil_im = pil_im.rotate(-90, expand=True)
-        if pil_im.size != (LEFT_PANE_W, LEFT_PANE_H):
-            pil_im = pil_im.resize((LEFT_PANE_W, LEFT_PANE_H), Image.Resampling.LANCZOS)
-        latest_frame = pil_im
+        out = np.empty((LEFT_PANE_H, LEFT_PANE_W, 3), np.uint8)
+        preview_transform(frame, out)  # rot90 view + crop, no per-frame PIL rotate/LANCZOS
+        latest_frame = Image.fromarray(out)
         return True
     except Exception as e:
         logging.error(f"Frame capture failed: {e}")
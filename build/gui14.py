@@ -1,45 +1,66 @@
-import subprocess, sys, threading, time, os, logging, signal, platform
+import subprocess, sys, threading, time, os, logging, signal, platform, queue, math
 from pathlib import Path
-from tkinter import Tk, Canvas, PhotoImage
-from PIL import Image, ImageTk, ImageDraw
-import pandas as pd
+from collections import deque
+from tkinter import Tk, Canvas, PhotoImage, READABLE
 from datetime import datetime
-from picamera2 import Picamera2  # Using Picamera2 for Arducam
+from weight_channel import WeightChannelReader, channel_path, read_file_sample
+from file_watcher import FileWatcher
+from log_tail import LogTail
+from capture_store import PersistWorker
+from serial_commands import CommandClient, socket_path
+from stage_trace import stage_trace, config_file
+import upload_queue
+from upload_scheduler import read_status
+import spool
+from catalog import Catalog
+from layout_cache import load_layout
+# numpy, PIL and the camera stack are imported once the layout is on screen (see "Deferred imports")
+
+def process_age():
+    """Seconds since this process was exec'd, interpreter start-up included; 0 where there is no /proc."""
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return max(0.0, float(f.read().split()[0]) - started)
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+PROCESS_START = time.monotonic() - process_age()
+since_start = lambda: time.monotonic() - PROCESS_START
 
 # ===== Load Config =====
 def load_config(file):
     return {k.strip(): v.strip() for k, v in (line.split("=", 1) for line in open(file) if "=" in line)}
 
 BASE = Path(__file__).parent
-cfg = load_config(BASE / "config.txt")
+cfg = load_config(config_file(BASE / "config.txt"))
 
 ASSETS_PATH = Path(cfg["ASSETS_PATH"])
 DATA_FILE = Path(cfg["DATA_FILE"])
 STABLE_LOG_FILE = Path(cfg["STABLE_LOG_FILE"])
-SERIAL_INPUT_FILE = Path(cfg["SERIAL_INPUT_FILE"])
 STABILITY_LOG_FILE = BASE / cfg["STABILITY_LOG_FILE"]
 IMG_CSV = BASE / cfg["IMAGE_CONFIG"]
 TXT_CSV = BASE / cfg["TEXT_CONFIG"]
-SCRIPT = Path(cfg["INTERRUPT_SCRIPT"])
+LAYOUT_CACHE = BASE / cfg.get("LAYOUT_CACHE", "layout_cache")  # compiled layout + pre-scaled assets, per screen resolution
 LOG_FILE = BASE / cfg["LOG_FILE"]
 DEVICE_NAME = cfg.get("DEVICE_NAME", "OptiA1")
-UPLOAD_SCRIPT = BASE / "fileupload.py"
+SUPERVISOR_SCRIPT = BASE / "supervisor.py"
+UPLOAD_QUEUE = BASE / cfg.get("UPLOAD_QUEUE", "upload_queue.txt")
+UPLOAD_STATUS = BASE / cfg.get("UPLOAD_STATUS", "upload_status.json")  # written by the uploader's circuit breaker
+catalog = Catalog(BASE / cfg.get("CATALOG", "catalog.db"))  # capture metadata shared with the uploader
 
-SAVE_FOLDER = BASE / "saved"
-TEMP_FOLDER = BASE / "temp"
+SAVE_FOLDER = BASE / cfg.get("SAVE_FOLDER", "saved")
+TEMP_FOLDER = BASE / cfg.get("TEMP_FOLDER", "temp")
 SAVE_FOLDER.mkdir(exist_ok=True)
 TEMP_FOLDER.mkdir(exist_ok=True)
+persist = PersistWorker()  # all capture encoding and renaming happens off the Tk thread
+trace = stage_trace(cfg)
 
-SERIAL_SENDER_SCRIPT = BASE / "serial_file_sender.py"
 
 # ===== Logging =====
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
-# ===== Load CSVs =====
-images = pd.read_csv(IMG_CSV).to_dict(orient="records")
-texts = pd.read_csv(TXT_CSV).to_dict(orient="records")
-rel_asset = lambda p: ASSETS_PATH / p
-
 # ===== GUI Setup =====
 win = Tk()
 win.attributes('-fullscreen', True)  # Force full-screen mode
@@ -53,57 +74,99 @@ logging.info(f"Screen resolution: {screen_width}x{screen_height}")  # Log screen
 cv = Canvas(win, bg="#F5F5F3", height=screen_height, width=screen_width, bd=0, highlightthickness=0)
 cv.pack(fill="both", expand=True)  # Ensure canvas fills the entire window
 
+# ===== Load Layout =====
+# Images the GUI shows, hides or swaps; every other asset is flattened into one background image where stacking allows
+DYNAMIC_IMAGES = ("interrupt_light", "placehand", "scanrdy", "right_camera_pane", "network_wifi")
+# Positions, font sizes and assets already scaled for this screen; rebuilt only when a CSV or asset changes
+layout, layout_cached = load_layout(IMG_CSV, TXT_CSV, ASSETS_PATH, (screen_width, screen_height), LAYOUT_CACHE, DYNAMIC_IMAGES)
+placed = layout["images"]
+
+canvas_state = {}  # (item, option) -> value last given to Tk
+
+def set_item(item, **options):
+    # Only options whose value changed reach Tk, so a repeated update never damages the canvas
+    changed = {k: v for k, v in options.items() if (item, k) not in canvas_state or canvas_state[(item, k)] != v}
+    if changed:
+        canvas_state.update(((item, k), v) for k, v in changed.items())
+        cv.itemconfigure(item, **changed)
+
 # Keep references to avoid garbage collection
-img_refs, img_ids = {}, {}
-for r in images:
-    img = PhotoImage(file=rel_asset(r["file_name"]))
-    img_refs[r["variable_name"]] = img
-    img_ids[r["variable_name"]] = cv.create_image(r["x_pos"] * screen_width / 1920, r["y_pos"] * screen_height / 1080, image=img)
+img_refs, img_ids = {"background": PhotoImage(file=layout["background"])}, {}
+cv.create_image(0, 0, anchor="nw", image=img_refs["background"])
+for name, r in placed.items():
+    if r.get("flat"):
+        continue
+    img = PhotoImage(file=r["file"])
+    img_refs[name] = img
+    img_ids[name] = cv.create_image(r["x"], r["y"], image=img)
 if "interrupt_light" in img_ids:
-    cv.itemconfigure(img_ids["interrupt_light"], state="hidden")
+    set_item(img_ids["interrupt_light"], state="hidden")
+if layout["wifi_offline"]:
+    img_refs["network_wifi_offline"] = PhotoImage(file=layout["wifi_offline"])  # shown while uploads are paused
 
 # Log available image IDs for debugging
-logging.info(f"Available image IDs: {list(img_ids.keys())}")
+logging.info(f"Available image IDs: {list(img_ids.keys())}, flattened into the background: {[n for n, r in placed.items() if r.get('flat')]}")
 
 txt_ids = {}
-for t in texts:
-    txt_ids[t["key"]] = cv.create_text(t["x_pos"] * screen_width / 1920, t["y_pos"] * screen_height / 1080, anchor="nw", text=t["text"],
-                                       fill=t["color"], font=(t["font_name"], int(t["font_size"] * min(screen_width / 1920, screen_height / 1080))))
+for key, t in layout["texts"].items():
+    txt_ids[key] = cv.create_text(t["x"], t["y"], anchor="nw", text=t["text"], fill=t["color"], font=tuple(t["font"]))
 
 # Set initial visibility for placehand and scanrdy
 for img_name in ["placehand", "scanrdy"]:
     if img_name in img_ids:
-        cv.itemconfigure(img_ids[img_name], state="normal")
+        set_item(img_ids[img_name], state="normal")
         logging.info(f"Set initial visibility for {img_name} to normal")
     else:
         logging.warning(f"Image {img_name} not found in img_ids")
 
-# ===== Camera Setup =====
-ROTATE_RIGHT_90 = True
-RADIUS = 50
+# Paint now: everything below (imports, camera, temp reclaim) happens with the layout already on screen
+win.update()
+logging.info(f"Layout on screen {since_start():.2f} s after process start (layout cache {'hit' if layout_cached else 'rebuilt'})")
+trace.mark("gui_painted", since_start=round(since_start(), 3))
 
-# Get positions and dimensions from camera pane images
-left_pane_info = next((item for item in images if item["variable_name"] == "left_camera_pane"), None)
-right_pane_info = next((item for item in images if item["variable_name"] == "right_camera_pane"), None)
+# ===== Deferred imports =====
+import numpy as np
+from PIL import Image, ImageTk, ImageDraw
+from camera_worker import CaptureWorker, PreviewGovernor, PreviewSurface, ROT90_K, align_up, preview_configuration, make_preview_transform
+if cfg.get("CAMERA") == "synthetic":
+    from synthetic_camera import SyntheticCamera as Picamera2  # benchmarks and development without a sensor
+else:
+    from picamera2 import Picamera2  # Using Picamera2 for Arducam
+logging.info(f"Camera stack imported {since_start():.2f} s after process start")
 
-# Load camera pane images to get their exact dimensions
-left_pane_img = Image.open(rel_asset("leftcamerapane.png"))
-right_pane_img = Image.open(rel_asset("rightcamerapane.png"))
+reclaimed, reclaimed_bytes = spool.reclaim_temp(TEMP_FOLDER, catalog, SAVE_FOLDER)  # nothing is being captured yet: all of temp/ is left over
+if reclaimed:
+    logging.info(f"Reclaimed {reclaimed} orphaned temp captures ({reclaimed_bytes / 1e6:.1f} MB)")
 
-LEFT_PANE_W, LEFT_PANE_H = left_pane_img.size
-RIGHT_PANE_W, RIGHT_PANE_H = right_pane_img.size
+# ===== Camera Setup =====
+PREVIEW_ROTATION = int(cfg.get("PREVIEW_ROTATION", 90))  # clockwise degrees
+STILL_SIZE = tuple(int(v) for v in cfg["STILL_SIZE"].split("x")) if cfg.get("STILL_SIZE") else None  # sensor-oriented WxH
+LORES_FORMAT = cfg.get("LORES_FORMAT", "YUV420")
+RING_FRAMES = int(cfg.get("RING_FRAMES", 6))
+RING_FPS = float(cfg.get("RING_FPS", 10))
+PRE_TRIGGER = float(cfg.get("PRE_TRIGGER_MS", 300)) / 1000
+CAPTURE_WINDOW = float(cfg.get("CAPTURE_WINDOW_MS", 1500)) / 1000
+CAPTURE_MIN_SETTLE = float(cfg.get("CAPTURE_MIN_SETTLE_MS", 300)) / 1000  # earliest a settled scene ends the capture
+RADIUS = round(50 * layout["scale"])  # corner radius of the camera panes, scaled with them
+
+# Camera pane positions and (scaled) dimensions from the layout
+left_pane_info, right_pane_info = placed.get("left_camera_pane"), placed.get("right_camera_pane")
+LEFT_PANE_W, LEFT_PANE_H = left_pane_info["size"] if left_pane_info else Image.open(ASSETS_PATH / "leftcamerapane.png").size
+RIGHT_PANE_W, RIGHT_PANE_H = right_pane_info["size"] if right_pane_info else Image.open(ASSETS_PATH / "rightcamerapane.png").size
 
-# Scale positions for different screen resolutions
 if left_pane_info:
-    left_video_id = cv.create_image(left_pane_info["x_pos"] * screen_width / 1920, left_pane_info["y_pos"] * screen_height / 1080, image=None)
+    left_video_id = cv.create_image(left_pane_info["x"], left_pane_info["y"], image=None)
 else:
     left_video_id = cv.create_image(491 * screen_width / 1920, 562 * screen_height / 1080, image=None)  # Fallback
+# One item for the captured still, reused for every capture and hidden in between
+if right_pane_info:
+    right_capture_id = cv.create_image(right_pane_info["x"], right_pane_info["y"], image=None, state="hidden")
+else:
+    right_capture_id = cv.create_image(1427.85693359375 * screen_width / 1920, 562 * screen_height / 1080, image=None, state="hidden")
 
 right_id = None
-latest_frame = None
-captured_path = None
+captured_path, captured_ts, capture_id, captured_dir = None, None, None, None
 prev_flag = None
-last_mtime = None
 
 # Create masks that match the exact size and shape of camera panes
 left_mask = Image.new("L", (LEFT_PANE_W, LEFT_PANE_H), 0)
@@ -116,190 +179,325 @@ ImageDraw.Draw(right_mask).rounded_rectangle((0, 0, RIGHT_PANE_W, RIGHT_PANE_H),
 # Picamera2 setup
 picam2 = None
 camera_ready = False
+cam_worker = None
+preview_surface = None
+still_rotation = 0
+PREVIEW_STATS_INTERVAL = 10  # seconds between preview FPS log lines
+last_stats_log = time.monotonic()
+governor = PreviewGovernor(active_fps=int(cfg.get("PREVIEW_FPS", 30)), idle_fps=int(cfg.get("PREVIEW_IDLE_FPS", 4)),
+                           idle_after=float(cfg.get("PREVIEW_IDLE_AFTER", 20)))
+camera_fps = governor.active_fps
+
+def configure_camera():
+    # Full-resolution main + lores preview where the ISP allows it, otherwise the single preview stream
+    still_size = STILL_SIZE or picam2.sensor_resolution
+    try:
+        config, software_rotation = preview_configuration(picam2, (LEFT_PANE_W, LEFT_PANE_H), PREVIEW_ROTATION, fps=governor.active_fps,
+                                                          still_size=still_size, lores_format=LORES_FORMAT)
+        picam2.configure(config)
+        return config, software_rotation
+    except Exception as e:
+        logging.error(f"Dual-stream configuration failed, saving preview-size stills: {e}")
+    config, software_rotation = preview_configuration(picam2, (LEFT_PANE_W, LEFT_PANE_H), PREVIEW_ROTATION, fps=governor.active_fps)
+    picam2.configure(config)
+    return config, software_rotation
 
 def init_cam():
-    global picam2, camera_ready
+    global picam2, camera_ready, cam_worker, still_rotation
     try:
         picam2 = Picamera2()
-        config = picam2.create_preview_configuration(main={"size": (LEFT_PANE_W, LEFT_PANE_H), "format": "RGB888"})
-        picam2.configure(config)
+        config, still_rotation = configure_camera()
         picam2.start()
+        cam_worker = CaptureWorker(picam2, (LEFT_PANE_H, LEFT_PANE_W, 4), make_preview_transform(still_rotation),
+                                   alpha=np.asarray(left_mask), config=config, ring_frames=RING_FRAMES, ring_fps=RING_FPS,
+                                   preview_crop=align_up((LEFT_PANE_H, LEFT_PANE_W) if still_rotation % 180 else (LEFT_PANE_W, LEFT_PANE_H), (2, 2)))
+        cam_worker.start()
         camera_ready = True
-        logging.info("CSI camera initialized (Picamera2, RGB888)")
+        preview_stream = config["lores"] if cam_worker.dual else config["main"]
+        logging.info(f"CSI camera initialized (Picamera2, main {config['main']['size']}, preview {preview_stream['size']} {preview_stream['format']}, "
+                     f"software rotation {still_rotation}), capture thread started")
     except Exception as e:
         logging.error(f"Camera init failed: {e}")
         camera_ready = False
 
-def capture_frame():
-    global latest_frame
-    if not camera_ready:
-        return False
-    try:
-        frame = picam2.capture_array()
-        pil_im = Image.fromarray(frame)  # Picamera2 outputs RGB888, no BGR2RGB conversion needed
-        if ROTATE_RIGHT_90:
-            pil_im = pil_im.rotate(-90, expand=True)
-        if pil_im.size != (LEFT_PANE_W, LEFT_PANE_H):
-            pil_im = pil_im.resize((LEFT_PANE_W, LEFT_PANE_H), Image.Resampling.LANCZOS)
-        latest_frame = pil_im
-        return True
-    except Exception as e:
-        logging.error(f"Frame capture failed: {e}")
-        return False
-
 def update_cam():
-    if camera_ready and capture_frame():
-        img_copy = latest_frame.copy()
-        img_copy.putalpha(left_mask)
-        imgtk = ImageTk.PhotoImage(image=img_copy)
-        cv.itemconfig(left_video_id, image=imgtk)
-        img_refs["video_feed"] = imgtk
-    win.after(15, update_cam)
+    # Buffer slots already carry the rounded-corner alpha, so a frame is a single in-place blit
+    global last_stats_log, preview_surface, camera_fps
+    frame = cam_worker.buffer.latest() if camera_ready else None
+    if frame is not None:
+        t0 = time.perf_counter()
+        if preview_surface is None:
+            logging.info(f"First camera frame {since_start():.2f} s after process start")
+            trace.mark("gui_first_frame", since_start=round(since_start(), 3))
+            preview_surface = PreviewSurface((LEFT_PANE_W, LEFT_PANE_H))
+            cv.itemconfig(left_video_id, image=preview_surface.photo)
+            img_refs["video_feed"] = preview_surface.photo
+        preview_surface.blit(frame)
+        governor.render_cost(time.perf_counter() - t0)
+    while not captured_frames.empty():
+        show_captured(*captured_frames.get_nowait())
+    if camera_ready:
+        cam_worker.ring_enabled = not governor.idle  # no pre-trigger history needed while nobody is at the station
+    if camera_ready and governor.fps() != camera_fps:
+        camera_fps = governor.fps()
+        try:
+            cam_worker.set_fps(camera_fps)
+            logging.info(f"Preview governor: {'idle' if governor.idle else 'active'}, camera at {camera_fps} fps")
+        except Exception as e:
+            logging.error(f"Camera frame rate change failed: {e}")
+    if camera_ready and time.monotonic() - last_stats_log >= PREVIEW_STATS_INTERVAL:
+        last_stats_log = time.monotonic()
+        logging.info(f"Preview: {cam_worker.report()}, render {governor.cost*1000:.1f} ms/frame")
+    win.after(governor.interval_ms(), update_cam)
 
 # ===== Time Update =====
 def update_time():
     if "TIME_TEXT" in txt_ids:
-        cv.itemconfig(txt_ids["TIME_TEXT"], text=datetime.now().strftime("%H:%M"))
+        set_item(txt_ids["TIME_TEXT"], text=datetime.now().strftime("%H:%M"))  # redrawn once a minute, not every second
     win.after(1000, update_time)
 
 # ===== Stable Weight Reader =====
+stable_log_tail = LogTail(STABLE_LOG_FILE)
+
 def last_stable_weight():
+    # Only bytes appended since the previous call are read, however long the log grows
     try:
-        if not STABLE_LOG_FILE.exists(): return None
-        lines = [l.strip() for l in open(STABLE_LOG_FILE) if l.strip()]
-        if lines and "Stable weight:" in lines[-1]:
-            return lines[-1].split("Stable weight:")[1].strip().replace("kg", "").strip()
+        line = stable_log_tail.last_line()
+        if line and "Stable weight:" in line:
+            # "... Stable weight: 0.74 kg [0.7412]" optionally followed by "(predicted, confidence 0.93)"
+            rest = line.split("Stable weight:")[1]
+            w = rest.split()[0]
+            exact = float(rest.split("[")[1].split("]")[0]) if "[" in rest else float(w)
+            return w, exact, "(predicted" in rest
     except Exception as e:
         logging.error(f"Read stable weight error: {e}")
     return None
 
+serial_commands = CommandClient(socket_path(cfg))
+
 def send_data_to_serial(data):
+    # Queued in order on the command socket; nothing is dropped if the sender is still starting
     try:
-        with open(SERIAL_INPUT_FILE, 'w') as f:
-            f.write(data.strip())
+        if serial_commands.send(data.strip()):
+            logging.warning(f"Serial command '{data.strip()}' pending: sender not listening yet")
     except Exception as e:
-        print("failed to write to serial input file")
+        logging.error(f"Serial command error: {e}")
 
-stability_weights = []
+stability_weights = deque(maxlen=600)  # bounded: ~30 s of samples at 20 Hz
 
 def monitor_stable_log():
-    global last_mtime, captured_path, right_id, stability_weights
+    # Called by the file watcher only when stable_weight_log.txt actually changes
+    global captured_path, stability_weights
     try:
-        if STABLE_LOG_FILE.exists():
-            m = os.path.getmtime(STABLE_LOG_FILE)
-            if last_mtime is None: last_mtime = m
-            elif m > last_mtime:
-                last_mtime = m
-                w = last_stable_weight()
-                if w and captured_path and captured_path.exists():
-                    safe_w = w.replace(".", "x")
-                    ts = captured_path.stem.split(f"{DEVICE_NAME}_")[1]
-                    final = SAVE_FOLDER / f"{DEVICE_NAME}_{ts}_{safe_w}.jpg"
-                    Image.open(captured_path).save(final)
-                    captured_path.unlink()
-                    logging.info(f"Event 2: Stable weight detected, saved {final}")
-
-                    with open(STABILITY_LOG_FILE, "a") as f:
-                        f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: " +
-                                ", ".join(f"{val:.2f}" for val in stability_weights) +
-                                f" -- stable (final: {w} kg)\n")
-                    stability_weights.clear()
-                    captured_path = None
-                    if right_id:
-                        cv.delete(right_id)
-                        right_id = None
-                        cv.itemconfigure(img_ids["right_camera_pane"], state="normal")
-                        img_refs["captured_right"] = None
-                        send_data_to_serial("s")
-                    
-                    # Show placehand and scanrdy again after image is saved
-                    for img_name in ["placehand", "scanrdy"]:
-                        if img_name in img_ids:
-                            cv.itemconfigure(img_ids[img_name], state="normal")
-                            logging.info(f"Set {img_name} to normal after image saved")
-                        else:
-                            logging.warning(f"Image {img_name} not found in img_ids when setting to normal")
+        stable = last_stable_weight()
+        if stable and captured_path:
+            w, exact, predicted = stable
+            safe_w = w.replace(".", "x")
+            # The capture id keeps names unique even for two captures within the same second
+            captured_dir.mkdir(exist_ok=True)
+            final = captured_dir / f"{DEVICE_NAME}_{captured_ts}_{safe_w}_{capture_id}.jpg"
+            temp, cid, stable_at = captured_path.name, capture_id, time.time()
+
+            with open(STABILITY_LOG_FILE, "a") as f:
+                stability_ref = f"{STABILITY_LOG_FILE.name}:{f.tell()}"
+                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: " +
+                        ", ".join(f"{val:.2f}" for val in stability_weights) +
+                        f" -- stable (final: {w} kg)\n")
+
+            def on_saved(p):
+                # Runs on the persist thread once the rename is done: the uploader picks it up within a second
+                rel = p.relative_to(SAVE_FOLDER).as_posix()
+                catalog.mark_saved(cid, rel, exact, stable_at, predicted, stability_ref)
+                trace.mark("saved", p.name, temp=temp)
+                upload_queue.append(UPLOAD_QUEUE, rel)
+            # Path first: an upload sweep between the rename and on_saved() must find this row, not add a legacy one
+            catalog.set_path(cid, final.relative_to(SAVE_FOLDER).as_posix())
+            # Queued behind the capture's own encode, so the temp file exists by the time this runs
+            persist.finalize(captured_path, final, on_saved)
+            trace.mark("stable_seen", final.name, temp=temp)
+            logging.info(f"Event 2: Stable weight detected, saving {final}")
+
+            stability_weights.clear()
+            captured_path = None
+            governor.activity()
+            if right_id:
+                reset_right_pane()
+            else:
+                stable_seen.add(cid)  # still not chosen yet: show_captured() resets once it has shown it
+            
+            # Show placehand and scanrdy again after image is saved
+            for img_name in ["placehand", "scanrdy"]:
+                if img_name in img_ids:
+                    set_item(img_ids[img_name], state="normal")
+                    logging.info(f"Set {img_name} to normal after image saved")
+                else:
+                    logging.warning(f"Image {img_name} not found in img_ids when setting to normal")
 
     except Exception as e:
         logging.error(f"Stable log monitor error: {e}")
-    win.after(200, monitor_stable_log)
 
-# ===== File Monitoring =====
+# ===== Weight Monitoring =====
+weight_channel = WeightChannelReader(channel_path(cfg), listen=True)
+CHANNEL_POLL_MS = 10  # only without a notification socket (Windows): a header read, well under the 10 ms budget
+CHANNEL_IDLE_POLL_MS = 100
+CHANNEL_RETRY_MS = 1000
+
+def read_channel():
+    try:
+        if camera_ready and weight_channel.available():
+            lost = weight_channel.lost
+            for s in weight_channel.read():
+                handle_sample(s.interrupt, s.weight, s.estimate, s.confidence)
+            if weight_channel.lost != lost:
+                logging.warning(f"Weight channel overrun: {weight_channel.lost - lost} samples lost")
+    except Exception as e:
+        logging.error(f"File monitor error: {e}")
+
+def on_channel_notify(*_):
+    weight_channel.drain()  # the handler is level-triggered, so empty the socket even before the camera is up
+    read_channel()
+
 def monitor_file():
-    global captured_path, prev_flag, right_id, stability_weights
+    # The shared-memory channel wakes the GUI through its notification socket, and the file fallback
+    # through the file watcher; this timer catches up after start-up and polls only where neither exists
+    read_channel()
+    poll = CHANNEL_RETRY_MS
+    if weight_channel.fileno() is None and weight_channel.available():
+        poll = CHANNEL_IDLE_POLL_MS if governor.idle else CHANNEL_POLL_MS
+    if serial_commands.pending:
+        serial_commands.flush()
+    win.after(poll, monitor_file)
+
+def read_data_file():
     try:
-        if camera_ready and DATA_FILE.exists():
-            flag, weight = open(DATA_FILE).read().strip().split(",", 1)
-            flag, w_val = int(flag), weight.strip().replace(" kg", "")
-            try: wf = float(w_val)
-            except: wf = 0.0
-            disp = f"{wf*1000:.1f} g" if wf < 1 else f"{wf:.2f} kg"
-            if "WEIGHT_TEXT" in txt_ids: cv.itemconfig(txt_ids["WEIGHT_TEXT"], text=disp)
-            if flag == 1: stability_weights.append(wf)
-            if prev_flag == 0 and flag == 1:
-                logging.info("Event 1: Interrupt 0→1 detected, preparing to capture image")
-                send_data_to_serial("y")
-                if "interrupt_light" in img_ids:
-                    cv.itemconfigure(img_ids["interrupt_light"], state="normal")
-                    logging.info("Set interrupt_light to normal")
-                
-                # Hide placehand and scanrdy when interrupt light appears
-                for img_name in ["placehand", "scanrdy"]:
-                    if img_name in img_ids:
-                        cv.itemconfigure(img_ids[img_name], state="hidden")
-                        logging.info(f"Set {img_name} to hidden when interrupt_light appears")
-                    else:
-                        logging.warning(f"Image {img_name} not found in img_ids when hiding")
-
-                def delayed_capture():
-                    global captured_path, right_id
-                    if capture_frame():
-                        ts = datetime.now().strftime("%H-%M-%S_%Y-%m-%d")
-                        captured_path = TEMP_FOLDER / f"{DEVICE_NAME}_{ts}.jpg"
-                        latest_frame.save(captured_path)
-                        
-                        img_copy = latest_frame.copy()
-                        if img_copy.size != (RIGHT_PANE_W, RIGHT_PANE_H):
-                            img_copy = img_copy.resize((RIGHT_PANE_W, RIGHT_PANE_H), Image.Resampling.LANCZOS)
-                        img_copy.putalpha(right_mask)
-                        
-                        imgtk = ImageTk.PhotoImage(image=img_copy)
-                        
-                        if right_pane_info:
-                            right_id = cv.create_image(right_pane_info["x_pos"] * screen_width / 1920, right_pane_info["y_pos"] * screen_height / 1080, image=imgtk)
-                        else:
-                            right_id = cv.create_image(1427.85693359375 * screen_width / 1920, 562 * screen_height / 1080, image=imgtk)
-                            
-                        cv.itemconfigure(img_ids["right_camera_pane"], state="hidden")
-                        img_refs["captured_right"] = imgtk
-                    win.after(5000, lambda: cv.itemconfigure(img_ids["interrupt_light"], state="hidden"))
-                    send_data_to_serial("z")
-
-                win.after(1000, delayed_capture)
-            prev_flag = flag if prev_flag is not None else flag
+        if camera_ready and not weight_channel.available() and DATA_FILE.exists():
+            handle_sample(*read_file_sample(DATA_FILE))
     except Exception as e:
         logging.error(f"File monitor error: {e}")
-    win.after(200, monitor_file)
+
+# ===== File Watching =====
+file_watcher = FileWatcher([STABLE_LOG_FILE, DATA_FILE, UPLOAD_STATUS])
+logging.info(f"File watcher using {'inotify' if file_watcher.native else 'polling fallback'}")
+
+def on_files_changed(paths):
+    if STABLE_LOG_FILE.resolve() in paths:
+        monitor_stable_log()
+    if DATA_FILE.resolve() in paths:
+        read_data_file()
+    if UPLOAD_STATUS.resolve() in paths:
+        update_network_indicator()
+
+def update_network_indicator():
+    # Breaker open: uploads are paused until the server is reachable again
+    if "network_wifi_offline" not in img_refs:
+        return
+    offline = read_status(UPLOAD_STATUS).get("state") == "open"
+    set_item(img_ids["network_wifi"], image=img_refs["network_wifi_offline" if offline else "network_wifi"])
+
+def handle_sample(flag, wf, estimate=math.nan, confidence=0.0):
+    global prev_flag
+    disp = f"{wf*1000:.1f} g" if wf < 1 else f"{wf:.2f} kg"
+    if flag == 1 and confidence > 0 and not math.isnan(estimate):
+        # Provisional forecast from the settle estimator while the tray is still bouncing
+        disp = f"~{estimate*1000:.0f} g" if estimate < 1 else f"~{estimate:.2f} kg"
+    if "WEIGHT_TEXT" in txt_ids: set_item(txt_ids["WEIGHT_TEXT"], text=disp)  # most samples repeat the displayed value
+    governor.weight(wf)
+    if flag == 1:
+        stability_weights.append(wf)
+        governor.activity()
+    if prev_flag == 0 and flag == 1:
+        logging.info("Event 1: Interrupt 0→1 detected, preparing to capture image")
+        trace.mark("trigger", weight=wf)
+        send_data_to_serial("y")
+        if "interrupt_light" in img_ids:
+            set_item(img_ids["interrupt_light"], state="normal")
+            logging.info("Set interrupt_light to normal")
+        
+        # Hide placehand and scanrdy when interrupt light appears
+        for img_name in ["placehand", "scanrdy"]:
+            if img_name in img_ids:
+                set_item(img_ids[img_name], state="hidden")
+                logging.info(f"Set {img_name} to hidden when interrupt_light appears")
+            else:
+                logging.warning(f"Image {img_name} not found in img_ids when hiding")
+
+        start_capture(time.monotonic())
+    prev_flag = flag if prev_flag is not None else flag
+
+# ===== Capture =====
+captured_frames = queue.Queue()  # (capture id, best frame) chosen on the capture thread, shown by update_cam()
+stable_seen = set()  # capture ids whose stable weight arrived before their still was shown
+
+def start_capture(trigger):
+    # No fixed delay: the capture thread picks the sharpest, settled frame around the trigger
+    global captured_path, captured_ts, capture_id, captured_dir
+    if not camera_ready:
+        return
+    now = datetime.now()
+    captured_ts, capture_id = now.strftime("%H-%M-%S_%Y-%m-%d"), catalog.new_capture(DEVICE_NAME, now.timestamp())
+    captured_dir = spool.shard(SAVE_FOLDER, now)
+    path = captured_path = TEMP_FOLDER / f"{DEVICE_NAME}_{captured_ts}_{capture_id}.jpg"
+    fill, k, cid = persist.save_pending(captured_path), ROT90_K[still_rotation % 360], capture_id
+
+    def on_chosen(frame):
+        still = np.rot90(frame, k) if k else frame
+        fill(still)
+        trace.mark("captured", path.name)
+        # Strided view just larger than the pane keeps the hand-off to the Tk thread small
+        step = max(1, min(still.shape[0] // RIGHT_PANE_H, still.shape[1] // RIGHT_PANE_W))
+        captured_frames.put((cid, np.ascontiguousarray(still[::step, ::step])))
+
+    def on_cancelled():
+        # A new trigger came before this capture's frame was chosen: free its persist slot now
+        fill(None)
+        catalog.mark_abandoned(cid, "superseded by a new capture before a frame was chosen")
+
+    cam_worker.capture_best(trigger, on_chosen, pre_trigger=PRE_TRIGGER, window=CAPTURE_WINDOW, on_cancel=on_cancelled,
+                           min_settle=CAPTURE_MIN_SETTLE)
+
+def show_captured(cid, frame):
+    global right_id
+    img_copy = Image.fromarray(frame)
+    if img_copy.size != (RIGHT_PANE_W, RIGHT_PANE_H):
+        img_copy = img_copy.resize((RIGHT_PANE_W, RIGHT_PANE_H), Image.Resampling.LANCZOS)
+    img_copy.putalpha(right_mask)
+
+    imgtk = ImageTk.PhotoImage(image=img_copy)
+
+    right_id = right_capture_id
+    cv.itemconfigure(right_id, image=imgtk)
+    set_item(right_id, state="normal")
+    set_item(img_ids["right_camera_pane"], state="hidden")
+    img_refs["captured_right"] = imgtk
+    win.after(5000, lambda: set_item(img_ids["interrupt_light"], state="hidden"))
+    send_data_to_serial("z")
+    if cid in stable_seen:
+        # The item was already weighed and saved while the best frame was being chosen
+        stable_seen.discard(cid)
+        reset_right_pane()
+
+def reset_right_pane():
+    # Item done: back to the empty right pane, and tell the controller
+    global right_id
+    set_item(right_id, state="hidden")
+    cv.itemconfigure(right_id, image="")
+    right_id = None
+    set_item(img_ids["right_camera_pane"], state="normal")
+    img_refs["captured_right"] = None
+    send_data_to_serial("s")
 
 # ===== Subprocess Handling =====
-subproc_handle = None
-serial_handle = None
-upload_handle = None
+supervisor_handle = None
 
 def run_script():
-    global subproc_handle, serial_handle, upload_handle
+    # One supervisor runs the stability script, the serial sender and the uploader, as threads or processes (SERVICE_MODE)
+    global supervisor_handle
     try:
         creation_flags = subprocess.CREATE_NEW_PROCESS_GROUP if platform.system() == "Windows" else 0
         start_new_session = None if platform.system() == "Windows" else True
         
-        subproc_handle = subprocess.Popen([sys.executable, str(SCRIPT)], creationflags=creation_flags, start_new_session=start_new_session)
-        logging.info("Interrupt script started")
-        
-        serial_handle = subprocess.Popen([sys.executable, str(SERIAL_SENDER_SCRIPT)], creationflags=creation_flags, start_new_session=start_new_session)
-        logging.info("Serial file sender started")
-        
-        upload_handle = subprocess.Popen([sys.executable, str(UPLOAD_SCRIPT)], creationflags=creation_flags, start_new_session=start_new_session)
-        logging.info("File upload service started")
+        supervisor_handle = subprocess.Popen([sys.executable, str(SUPERVISOR_SCRIPT)], creationflags=creation_flags, start_new_session=start_new_session)
+        logging.info(f"Background services started ({cfg.get('SERVICE_MODE', 'threads')} mode)")
     except Exception as e:
         logging.error(f"Start script error: {e}")
 
@@ -310,12 +508,20 @@ def start_when_ready():
 # ===== Close Handling =====
 def on_close():
     try:
+        if cam_worker:
+            cam_worker.stop()
+            cam_worker.join(timeout=1)
         if picam2:
             picam2.stop()
     except:
         pass
+    file_watcher.close()
+    weight_channel.close()
+    serial_commands.close()
+    persist.stop()
+    persist.join(timeout=5)  # let queued captures reach disk
     
-    for handle in [subproc_handle, serial_handle, upload_handle]:
+    for handle in [supervisor_handle]:
         if handle and handle.poll() is None:
             try:
                 if platform.system() == "Windows":
@@ -330,8 +536,14 @@ def on_close():
     win.destroy()
 
 # ===== Initialize =====
+persist.start()
 threading.Thread(target=init_cam, daemon=True).start()
-threading.Thread(target=monitor_stable_log, daemon=True).start()
+file_watcher.attach_tk(win, on_files_changed)
+if weight_channel.fileno() is not None:
+    win.tk.createfilehandler(weight_channel.fileno(), READABLE, on_channel_notify)
+update_network_indicator()
+if platform.system() != "Windows":
+    signal.signal(signal.SIGTERM, lambda *_: win.after(0, on_close))  # e.g. benchmark.py stopping the station
 update_cam()
 update_time()
 win.after(100, start_when_ready)
@@ -1,4 +1,9 @@
-import time, subprocess, os
+import time, subprocess, os, sys, select, logging, platform, threading
+from weight_channel import WeightChannelWriter, channel_path, write_file_sample
+from stability import StabilityDetector, SettleEstimator
+from scale_ingest import ScaleReader
+from serial_commands import CommandServer, socket_path, parse_gaps
+from stage_trace import stage_trace, config_file, install_sigterm
 
 # ---------- Load Config ----------
 def load_config(file="config.txt"):
@@ -10,7 +15,7 @@ def load_config(file="config.txt"):
                 cfg[k] = v
     return cfg
 
-cfg = load_config()
+cfg = load_config(config_file("config.txt"))
 
 # Paths
 gen_script = cfg["RAW_DATA_SCRIPT"]
@@ -19,11 +24,33 @@ out_file   = cfg["DATA_FILE"]
 log_file   = cfg["STABLE_LOG_FILE"]
 
 # Stability parameters
-THRESHOLD, COUNT, DURATION = 0.05, 4, 8
+THRESHOLD = float(cfg.get("STABILITY_THRESHOLD", 0.05))
+WINDOW = int(cfg.get("STABILITY_WINDOW", 10))                   # samples the spread is measured over
+MIN_DWELL = float(cfg.get("STABILITY_MIN_DWELL_MS", 400)) / 1000  # window must stay within THRESHOLD this long
+SAMPLE_HZ = float(cfg.get("SAMPLE_HZ", 20))
+SETTLE_ESTIMATOR = cfg.get("SETTLE_ESTIMATOR", "0") == "1"       # finalize on a predicted weight before the window is flat
+SETTLE_CONFIDENCE = float(cfg.get("SETTLE_CONFIDENCE", 0.8))
+PRINT_INTERVAL = 1.0
 
-# State
-capture, start_time, history = False, None, []
+# Weight source: "file" polls raw_file at SAMPLE_HZ; "serial" reads every frame from the controller
+WEIGHT_SOURCE = cfg.get("WEIGHT_SOURCE", "file")
+SCALE_PORT = cfg.get("SCALE_PORT", "/dev/ttyACM0")
+SCALE_BAUD = int(cfg.get("SCALE_BAUD", 115200))
+# Development only: SIMULATE=1 starts RAW_DATA_SCRIPT to write fake weights into raw_file. Off on a real station,
+# where raw_file comes from the scale and a simulator would overwrite it
+SIMULATE = cfg.get("SIMULATE", "0") == "1"
+GEN_ARGS = cfg.get("GENERATOR_ARGS", "").split()  # e.g. "--scenario hand --hz 200 --seed 7"
+# In serial mode this process owns the port, so it also serves the GUI's command socket
+MIN_GAP = parse_gaps(cfg.get("SERIAL_MIN_GAP_MS", "250"))
+ACK_TIMEOUT = float(cfg.get("SERIAL_ACK_TIMEOUT_MS", 0)) / 1000
+ACK_RETRIES = int(cfg.get("SERIAL_ACK_RETRIES", 2))
+
+# State (set up by main(), so a supervisor restart starts clean)
+capture, start_time, latched = False, None, False
 proc = None
+channel = detector = estimator = None
+last_file = None
+trace = stage_trace(cfg)
 
 def read_raw():
     try:
@@ -32,41 +59,129 @@ def read_raw():
         return int(i), float(w.replace(" kg", "").strip())
     except: return 0, 0.0
 
-def write_out(i, w): open(out_file,"w").write(f"{i},{w:.2f} kg")
-def log_weight(w): open(log_file,"a").write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Stable weight: {w:.2f} kg\n")
-def stable(ws): return len(ws) >= COUNT and max(ws[-COUNT:]) - min(ws[-COUNT:]) <= THRESHOLD
+def write_out(i, w, estimate=None, confidence=0.0):
+    global last_file
+    channel.publish(i, w, estimate=estimate, confidence=confidence)
+    # The file fallback is only rewritten when its text would change
+    if (i, round(w, 2)) != last_file:
+        write_file_sample(out_file, i, w)
+        last_file = (i, round(w, 2))
+def log_weight(w, note=""): open(log_file,"a").write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Stable weight: {w:.2f} kg [{w:.4f}]{note}\n")  # bracketed value is the unrounded weight
 
 def start_gen():
     global proc
     if not proc:
         print("Launching generator...")
-        proc = subprocess.Popen(["start","cmd","/k","python",gen_script], shell=True)
+        windows = platform.system() == "Windows"
+        proc = subprocess.Popen([sys.executable, gen_script, *GEN_ARGS],
+                                creationflags=subprocess.CREATE_NEW_CONSOLE if windows else 0,
+                                start_new_session=not windows)
 
 def stop_gen():
-    if proc: subprocess.call(f"taskkill /F /T /PID {proc.pid}", shell=True)
+    global proc
+    if proc and proc.poll() is None:
+        proc.terminate()
+        try: proc.wait(timeout=2)
+        except subprocess.TimeoutExpired: proc.kill()
+    proc = None
 
-# --- Run ---
-start_gen()
-try:
-    while True:
-        intr, w = read_raw()
-        if not capture:
-            if intr==1:
-                capture, start_time, history = True, time.time(), [w]
-                write_out(1,w); print(f"[NORMAL→CAPTURE] {w:.2f} kg")
-            else:
-                write_out(0,0.0); print("[NORMAL] Interrupt=0")
+def step(intr, w, now, verbose):
+    """Advance the capture state machine by one sample."""
+    global capture, start_time, latched
+    if not capture:
+        if intr==1 and not latched:
+            capture, start_time = True, now
+            detector.start(now); detector.update(now, w)
+            if estimator: estimator.start(); estimator.update(w)
+            write_out(1,w); print(f"[NORMAL→CAPTURE] {w:.2f} kg")
+            trace.mark("interrupt", t=now, weight=w)
+        elif intr==1:
+            write_out(1,w)  # item still on the scale after its stable weight was logged
         else:
-            history.append(w); write_out(1,w)
-            print(f"[CAPTURE] {w:.2f} kg (elapsed={time.time()-start_time:.1f}s)")
-            if time.time()-start_time >= DURATION:
-                if stable(history):
-                    fw = sum(history[-COUNT:])/COUNT
-                    log_weight(fw); print(f"[STABLE] {fw:.2f} kg → Back to normal")
-                    capture = False
-                else: print("[NOT STABLE] Continuing capture...")
-        time.sleep(1)
-except KeyboardInterrupt:
-    print("\nStopping...")
-finally:
-    stop_gen()
+            latched = False
+            write_out(0,0.0)
+            if verbose: print("[NORMAL] Interrupt=0")
+    else:
+        est, conf = estimator.update(w) if estimator else (None, 0.0)
+        write_out(1, w, est, conf)
+        fw = detector.update(now, w)
+        if fw is not None:
+            log_weight(fw); print(f"[STABLE] {fw:.2f} kg after {now-start_time:.2f}s → Back to normal")
+            trace.mark("stable", t=now, weight=fw)
+            capture, latched = False, True
+        elif est is not None and conf >= SETTLE_CONFIDENCE:  # no estimate yet, whatever SETTLE_CONFIDENCE is
+            log_weight(est, f" (predicted, confidence {conf:.2f})")
+            trace.mark("stable", t=now, weight=est, predicted=True)
+            print(f"[PREDICTED] {est:.2f} kg (confidence {conf:.2f}) after {now-start_time:.2f}s → Back to normal")
+            capture, latched = False, True
+        elif verbose:
+            print(f"[CAPTURE] {w:.2f} kg (elapsed={now-start_time:.1f}s, spread={detector.window.spread:.3f})")
+
+def run_file(stop):
+    if SIMULATE:
+        start_gen()
+    period, next_tick, last_print = 1.0 / SAMPLE_HZ, time.monotonic(), 0.0
+    while not stop.is_set():
+        intr, w = read_raw()
+        now = time.monotonic()
+        verbose = now - last_print >= PRINT_INTERVAL
+        if verbose: last_print = now
+        step(intr, w, now, verbose)
+        # Fixed-rate schedule on the monotonic clock; skip ticks rather than drift if we fall behind
+        next_tick += period
+        delay = next_tick - time.monotonic()
+        if delay > 0: stop.wait(delay)
+        else: next_tick = time.monotonic()
+
+def run_serial(stop):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")  # command latency lines from CommandServer
+    last_print, reader = 0.0, None
+    def write(data):
+        if reader is None: raise ConnectionError("scale link down")
+        return reader.write(data)
+    commands = CommandServer(socket_path(cfg), write, MIN_GAP, ACK_TIMEOUT, ACK_RETRIES)
+    try:
+        while not stop.is_set():
+            try:
+                if reader is None:
+                    reader = ScaleReader(SCALE_PORT, SCALE_BAUD, on_line=commands.ack)
+                    print(f"Reading scale frames from {SCALE_PORT}")
+                due = commands.poll()
+                ready, _, _ = select.select([reader, commands], [], [], PRINT_INTERVAL if due is None else min(due, PRINT_INTERVAL))
+                if reader not in ready:
+                    continue
+                # Each frame keeps its own arrival time, so the dwell is measured at the controller's rate
+                for t, intr, w in reader.read():
+                    verbose = t - last_print >= PRINT_INTERVAL
+                    if verbose: last_print = t
+                    step(intr, w, t, verbose)
+            except (OSError, ConnectionError) as e:
+                print(f"Scale link error: {e}; retrying")
+                if reader: reader.close()
+                reader = None
+                stop.wait(1)
+    finally:
+        print(f"Serial commands: {commands.report()}")
+        commands.close()
+        if reader: reader.close()
+
+# --- Run ---
+def main(stop=None):
+    """Follow the scale and log stable weights until `stop` is set. State is reset on every call,
+    so a supervisor restart starts from a clean capture state machine."""
+    global capture, start_time, latched, channel, detector, estimator, last_file
+    stop = stop or threading.Event()
+    capture, start_time, latched, last_file = False, None, False, None
+    channel = WeightChannelWriter(channel_path(cfg))
+    detector = StabilityDetector(THRESHOLD, WINDOW, MIN_DWELL)
+    estimator = SettleEstimator(THRESHOLD) if SETTLE_ESTIMATOR else None
+    try:
+        run_serial(stop) if WEIGHT_SOURCE == "serial" else run_file(stop)
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        stop_gen()
+        channel.close()
+
+if __name__ == "__main__":
+    main(install_sigterm(threading.Event()))
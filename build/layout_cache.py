@@ -0,0 +1,123 @@
+# layout_cache.py
+# Screen layout for gui14.py. image_config.csv and text_config.csv are parsed with
+# the csv module, positions and font sizes are scaled from the 1920x1080 design
+# to the actual screen, and assets are resized to match. Assets the GUI never
+# changes are flattened into one opaque background image, so Tk composites a
+# single item under the few dynamic ones instead of a dozen alpha-blended PNGs
+# on every redraw. The result is kept per screen resolution as a JSON manifest
+# next to the background and the pre-scaled PNGs (and the faded wifi icon), so a
+# normal boot only stats the CSVs and assets and reads one small file; PIL is
+# imported only when something has to be rebuilt.
+import csv, json, logging, os
+from pathlib import Path
+
+DESIGN_W, DESIGN_H = 1920, 1080
+VERSION = 2  # bump when the manifest layout changes
+NUMERIC = {"x_pos": float, "y_pos": float, "font_size": int}
+
+
+def read_csv(path):
+    """Rows of a layout CSV as dicts, with the position and font size columns converted."""
+    with open(path, newline="") as f:
+        return [{k: NUMERIC[k](v) if k in NUMERIC else v for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def sources(img_csv, txt_csv, assets):
+    """mtime and size of every file the layout is built from; any change invalidates the cache."""
+    stamps = {str(img_csv): _stamp(img_csv), str(txt_csv): _stamp(txt_csv)}
+    for r in read_csv(img_csv):
+        p = Path(assets) / r["file_name"]
+        stamps[str(p)] = _stamp(p)
+    return stamps
+
+
+def _box(r):
+    """Screen rectangle of a centre-anchored canvas image, rounded the way Tk places it."""
+    x, y = round(r["x"]) - r["size"][0] // 2, round(r["y"]) - r["size"][1] // 2
+    return x, y, x + r["size"][0], y + r["size"][1]
+
+
+def _overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def flatten(images, dynamic):
+    """Names of the static images that can go into the background: those under every dynamic image they
+    overlap. A static image stacked above a dynamic one stays a canvas item, so the stacking order holds."""
+    names, flat = list(images), []
+    for i, name in enumerate(names):
+        if name in dynamic:
+            continue
+        above = [n for n in names[:i] if n in dynamic]
+        if not any(_overlap(_box(images[name]), _box(images[n])) for n in above):
+            flat.append(name)
+    return flat
+
+
+def compile_layout(img_csv, txt_csv, assets, screen, out_dir, dynamic=(), bg="#F5F5F3"):
+    """Build the layout for a (width, height) screen, writing pre-scaled assets and the flattened
+    background (every image not named in dynamic, where stacking allows) to out_dir."""
+    from PIL import Image, ImageOps
+    w, h = screen
+    sx, sy = w / DESIGN_W, h / DESIGN_H
+    scale = min(sx, sy)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    images, wifi_offline = {}, None
+    for r in read_csv(img_csv):
+        src = Path(assets) / r["file_name"]
+        with Image.open(src) as im:
+            size = im.size
+            if scale != 1:
+                size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+                src = out_dir / r["file_name"]
+                im.convert("RGBA").resize(size, Image.LANCZOS).save(src, compress_level=1)  # Tk decodes these on every boot
+            if r["variable_name"] == "network_wifi":
+                # Greyed-out, faded copy of the wifi icon for when the uploader cannot reach the server
+                icon = im.convert("RGBA").resize(size, Image.LANCZOS) if scale != 1 else im.convert("RGBA")
+                faded = ImageOps.grayscale(icon).convert("RGBA")
+                faded.putalpha(icon.getchannel("A").point(lambda a: a * 0.35))
+                wifi_offline = out_dir / "network_wifi_offline.png"
+                faded.save(wifi_offline, compress_level=1)
+        images[r["variable_name"]] = {"file": str(src), "x": r["x_pos"] * sx, "y": r["y_pos"] * sy, "size": list(size)}
+    flat = flatten(images, dynamic)
+    background = Image.new("RGBA", (w, h), bg)
+    for name in flat:
+        x0, y0 = _box(images[name])[:2]
+        with Image.open(images[name]["file"]) as im:
+            background.alpha_composite(im.convert("RGBA"), (max(0, x0), max(0, y0)), (max(0, -x0), max(0, -y0)))
+        images[name]["flat"] = True
+    background.convert("RGB").save(out_dir / "background.png", compress_level=1)
+    texts = {t["key"]: {"x": t["x_pos"] * sx, "y": t["y_pos"] * sy, "text": t["text"], "color": t["color"],
+                        "font": [t["font_name"], int(t["font_size"] * scale)]} for t in read_csv(txt_csv)}
+    return {"version": VERSION, "screen": [w, h], "scale": scale, "images": images, "texts": texts,
+            "background": str(out_dir / "background.png"), "wifi_offline": str(wifi_offline) if wifi_offline else None}
+
+
+def load_layout(img_csv, txt_csv, assets, screen, cache_dir, dynamic=(), bg="#F5F5F3"):
+    """Cached layout for this screen, rebuilt when a CSV, an asset or the dynamic set changed.
+    Returns (layout, cache hit)."""
+    out_dir = Path(cache_dir) / f"{screen[0]}x{screen[1]}"
+    manifest = out_dir / "layout.json"
+    stamps = sources(img_csv, txt_csv, assets)
+    options = {"dynamic": sorted(dynamic), "bg": bg}
+    try:
+        with open(manifest) as f:
+            layout = json.load(f)
+        if layout.get("version") == VERSION and layout.get("sources") == stamps and layout.get("options") == options:
+            return layout, True
+    except (OSError, ValueError):
+        pass
+    layout = compile_layout(img_csv, txt_csv, assets, screen, out_dir, dynamic, bg)
+    layout["sources"], layout["options"] = stamps, options
+    tmp = manifest.with_name(manifest.name + ".tmp")
+    try:
+        tmp.write_text(json.dumps(layout))
+        os.replace(tmp, manifest)  # a boot interrupted mid-write rebuilds instead of reading half a manifest
+    except OSError as e:
+        logging.warning(f"Could not write layout cache {manifest}: {e}")
+    return layout, False
@@ -0,0 +1,62 @@
+# log_tail.py
+# Constant-time access to the newest line of an append-only log. The first read
+# seeks back from EOF; later reads only consume bytes appended since the last
+# offset. A shrinking file (truncation), a new inode or changed leading bytes
+# (rotation, even when the filesystem reuses the inode) restart the scan.
+import os
+
+HEAD_BYTES = 64
+
+
+class LogTail:
+    def __init__(self, path, block=4096):
+        self.path, self.block = path, block
+        self.ino, self.offset, self.partial, self.last, self.head = None, 0, b"", None, b""
+
+    def last_line(self):
+        """Newest complete, non-empty line (without newline), or None."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.ino, self.offset, self.partial, self.last = None, 0, b"", None
+            return None
+        with open(self.path, "rb") as f:
+            head = f.read(HEAD_BYTES)
+            if st.st_ino != self.ino or st.st_size < self.offset or head[:len(self.head)] != self.head:
+                self.ino, self.head = st.st_ino, head
+                self.last, self.offset = self._scan_back(f, st.st_size)
+            elif st.st_size > self.offset:
+                self.head = head
+                f.seek(self.offset)
+                self._consume(f.read(st.st_size - self.offset))
+        return self.last
+
+    def _consume(self, data):
+        self.offset += len(data)
+        data = self.partial + data
+        head, sep, self.partial = data.rpartition(b"\n")
+        if sep:
+            for line in reversed(head.split(b"\n")):
+                if line.strip():
+                    self.last = line.decode(errors="replace").strip()
+                    break
+
+    def _scan_back(self, f, size):
+        # Walk backwards block by block until a complete non-empty line is found
+        start, buf = size, b""
+        self.partial = b""
+        while start > 0:
+            stop, start = start, max(0, start - self.block)
+            f.seek(start)
+            buf = f.read(stop - start) + buf
+            cut = buf.rfind(b"\n")
+            if cut < 0:
+                self.partial = buf
+                continue
+            self.partial = buf[cut + 1:]
+            lines = buf[:cut].split(b"\n")
+            # Unless we reached the start of the file, the first line may be cut off
+            for line in reversed(lines if start == 0 else lines[1:]):
+                if line.strip():
+                    return line.decode(errors="replace").strip(), size
+        return None, size
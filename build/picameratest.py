@@ -4,6 +4,8 @@
 from tkinter import Tk, Canvas
 from PIL import Image, ImageTk, ImageDraw
 from picamera2 import Picamera2
+from camera_worker import preview_configuration, make_preview_transform
+import numpy as np
 import time
 
 # ---- same preview geometry you use in gui9 ----
@@ -35,15 +37,18 @@ img_ref = {"live": None}
 picam2 = None
 camera_ready = False
 latest_frame = None
+preview_transform = None
+frame_buf = np.empty((PREVIEW_H, PREVIEW_W, 3), np.uint8)
 
 def init_cam():
-    global picam2, camera_ready
+    global picam2, camera_ready, preview_transform
     try:
         picam2 = Picamera2()
-        # Request frames at the preview box size in RGB888 (PIL-friendly)
-        cfg = picam2.create_preview_configuration(
-            main={"size": (PREVIEW_W, PREVIEW_H), "format": "RGB888"}
+        # Request frames that land exactly on the preview box once rotated (RGB888, PIL-friendly)
+        cfg, software_rotation = preview_configuration(
+            picam2, (PREVIEW_W, PREVIEW_H), 90 if ROTATE_RIGHT_90 else 0
         )
+        preview_transform = make_preview_transform(software_rotation)
         picam2.configure(cfg)
         picam2.start()
         camera_ready = True
@@ -53,22 +58,14 @@ def init_cam():
         camera_ready = False
 
 def capture_frame():
-    """SAME logic as gui9: capture_array -> optional rotate -> resize -> store PIL."""
+    """capture_array -> rot90 view + crop into a reused buffer -> store PIL."""
     global latest_frame
     if not camera_ready:
         return False
     try:
         frame = picam2.capture_array()          # RGB numpy array
-        pil_im = Image.fromarray(frame)         # to PIL
-
-        if ROTATE_RIGHT_90:
-            # PIL rotates CCW; -90 gives us a 90° right rotation
-            pil_im = pil_im.rotate(-90, expand=True)
-
-        if pil_im.size != (PREVIEW_W, PREVIEW_H):
-            pil_im = pil_im.resize((PREVIEW_W, PREVIEW_H), Image.Resampling.LANCZOS)
-
-        latest_frame = pil_im
+        preview_transform(frame, frame_buf)     # stream is already pane-sized; rotation is a view
+        latest_frame = Image.fromarray(frame_buf)
         return True
     except Exception as e:
         print("Frame capture failed:", e)
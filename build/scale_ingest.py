@@ -0,0 +1,107 @@
+# scale_ingest.py
+# Reads interrupt/weight frames straight from the scale controller's serial link
+# (/dev/ttyACM0) instead of a raw file rewritten by a generator. The port is put
+# in raw mode and read non-blocking, so every frame is seen at the controller's
+# native rate. Frames are text lines "<interrupt>,<weight>[ kg]\n", the same
+# format raw_interrupt_weight.txt has always used.
+import os, time, select, termios
+
+MAX_LINE = 64  # longer runs without a newline are line noise, not frames
+
+
+def open_port(path, baud=115200):
+    """Open a tty (or pty) raw, non-blocking, without making it our controlling terminal."""
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+        iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP |
+                   termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IXON)
+        oflag &= ~termios.OPOST
+        lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+        cflag = (cflag & ~(termios.CSIZE | termios.PARENB)) | termios.CS8 | termios.CREAD | termios.CLOCAL
+        speed = getattr(termios, f"B{baud}", ispeed)
+        cc[termios.VMIN], cc[termios.VTIME] = 0, 0
+        termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+    except termios.error:
+        pass  # not a terminal (e.g. a FIFO in tests); plain non-blocking reads still work
+    return fd
+
+
+class LineFramer:
+    """Splits a byte stream into (interrupt, weight) frames. Other lines (e.g. command
+    acknowledgements) go to `on_line` if given, otherwise they are counted as bad."""
+
+    def __init__(self, on_line=None):
+        self.buf, self.on_line = b"", on_line
+        self.bad = 0
+
+    def feed(self, data):
+        frames = []
+        lines = (self.buf + data).split(b"\n")
+        self.buf = lines.pop()
+        if len(self.buf) > MAX_LINE:
+            self.buf, self.bad = b"", self.bad + 1
+        for line in lines:
+            frame = parse_frame(line)
+            if frame is None:
+                if line.strip() and self.on_line:
+                    self.on_line(line.decode(errors="replace"))
+                else:
+                    self.bad += line.strip() != b""
+            else:
+                frames.append(frame)
+        return frames
+
+
+def parse_frame(line):
+    try:
+        i, w = line.split(b",", 1)
+        i = int(i)
+        if i not in (0, 1):
+            return None
+        return i, float(w.replace(b"kg", b"").strip())
+    except ValueError:
+        return None
+
+
+class ScaleReader:
+    """Non-blocking reader for the scale link. read() returns every frame received since
+    the last call as (t_monotonic, interrupt, weight); wait() blocks until data arrives."""
+
+    def __init__(self, path, baud=115200, on_line=None):
+        self.path, self.baud = path, baud
+        self.fd = open_port(path, baud)
+        self.framer = LineFramer(on_line)
+        self.frames = 0
+
+    def fileno(self):
+        return self.fd
+
+    def wait(self, timeout=None):
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def read(self):
+        out = []
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == 5:  # EIO: the other end (device or simulator) went away
+                    raise ConnectionError(f"{self.path} closed") from e
+                raise
+            if not data:
+                break
+            t = time.monotonic()
+            out.extend((t, i, w) for i, w in self.framer.feed(data))
+        self.frames += len(out)
+        return out
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
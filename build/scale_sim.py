@@ -0,0 +1,211 @@
+# scale_sim.py
+# Load-cell simulator for testing the weighing pipeline without the scale. Scenarios
+# are seeded, so the same seed always yields the same trace: an empty tray with
+# noise and drift, then items that land with a spike, bounce as a damped
+# oscillation, rest, and are lifted off (optionally after a hand presses on them).
+# Samples are generated on a virtual clock at --hz (up to several hundred Hz) and
+# written either to a pseudo-terminal that stands in for /dev/ttyACM0, to the raw
+# file interrupt_weightread_stability.py reads, or to stdout. Bytes sent back over
+# the pty (the GUI's y/z/s commands) are echoed and, with --ack, acknowledged.
+import os, sys, time, math, json, random, argparse
+from dataclasses import dataclass
+
+DEFAULT_LINK = "/tmp/optiwaste_scale"
+
+
+@dataclass
+class Item:
+    weight: float           # kg, the settled reading
+    idle: float = 3.0       # s of empty tray before it lands
+    hold: float = 6.0       # s it stays on the tray
+    spike: float = 0.6      # landing impulse, as a fraction of weight
+    overshoot: float = 0.3  # first swing of the oscillation, as a fraction of weight
+    period: float = 0.6     # s per oscillation
+    decay: float = 0.9      # s time constant of the oscillation envelope
+    press: float = 0.0      # extra kg from a hand pressing down just before removal (0: none)
+
+
+@dataclass
+class Cell:
+    noise: float = 0.002    # kg, gaussian noise per sample
+    drift: float = 0.0      # kg per minute of zero drift
+    remove: float = 0.25    # s for the weight to fall off when the item is lifted
+
+
+# Named scenarios: Cell settings and per-item parameter ranges drawn from the seeded RNG
+SCENARIOS = {
+    "steady":   (dict(), dict(overshoot=(0.05, 0.1), decay=(0.2, 0.4))),
+    "bouncy":   (dict(), dict(overshoot=(0.2, 0.4), decay=(0.6, 1.2))),
+    "noisy":    (dict(noise=0.01), dict(overshoot=(0.2, 0.4))),
+    "drifting": (dict(drift=0.05), dict()),
+    "hand":     (dict(), dict(press=(0.1, 0.5))),
+    "burst":    (dict(), dict(idle=(0.5, 1.0), hold=(2.0, 3.0), decay=(0.3, 0.6))),
+}
+
+
+def scenario(name="bouncy", items=10, seed=0, min_weight=0.2, max_weight=1.0, idle=None, hold=None):
+    """Cell settings and a reproducible list of Items for a named scenario."""
+    cell, ranges = SCENARIOS[name]
+    rng = random.Random(seed)
+    out = []
+    for _ in range(items):
+        params = {k: rng.uniform(*v) for k, v in ranges.items()}
+        if idle is not None: params["idle"] = idle
+        if hold is not None: params["hold"] = hold
+        out.append(Item(round(rng.uniform(min_weight, max_weight), 3), **params))
+    return Cell(**cell), out
+
+
+def trace(cell, items, hz=50, seed=0):
+    """Yield (t, interrupt, weight, item_index) on a virtual clock at `hz`; item_index is
+    None while the tray is empty. Deterministic for a given seed."""
+    rng, dt, n = random.Random(seed), 1.0 / hz, 0
+    for k, it in enumerate(items):
+        land = n * dt + it.idle
+        leave = land + it.hold
+        while n * dt < leave + cell.remove:
+            t = n * dt
+            zero = cell.drift * t / 60 + rng.gauss(0, cell.noise)
+            if t < land:
+                yield t, 0, max(0.0, zero), None
+            else:
+                s, w = t - land, it.weight
+                w += it.weight * it.spike * math.exp(-s / 0.03)  # impact, gone within ~0.1 s
+                w += it.weight * it.overshoot * math.exp(-s / it.decay) * math.cos(2 * math.pi * s / it.period)
+                if it.press and leave - 1.0 <= t < leave:
+                    w += it.press * min(1.0, (t - leave + 1.0) / 0.3)  # hand pushes down before lifting
+                if t >= leave:
+                    w *= max(0.0, 1.0 - (t - leave) / cell.remove)
+                # The controller drops the interrupt once the tray is nearly empty again
+                on = t < leave or w > 0.1 * it.weight
+                yield t, int(on), max(0.0, w + zero), k if on else None
+            n += 1
+
+
+class PtySink:
+    def __init__(self, link, ack=False):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.name, self.link, self.ack = os.ttyname(self.slave), link, ack
+        try:
+            os.unlink(link)
+        except FileNotFoundError:
+            pass
+        os.symlink(self.name, link)
+        os.set_blocking(self.master, False)
+
+    def write(self, i, w):
+        try:
+            os.write(self.master, f"{i},{w:.3f} kg\n".encode())
+        except BlockingIOError:
+            pass  # nobody reading and the pty buffer is full: drop the frame like a UART would
+        try:
+            cmd = os.read(self.master, 256)
+        except BlockingIOError:
+            return
+        if cmd:
+            print(f"Received {cmd!r}", file=sys.stderr)
+            if self.ack:
+                os.write(self.master, b"".join(b"ACK %c\n" % c for c in cmd))
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+        try:
+            os.unlink(self.link)
+        except FileNotFoundError:
+            pass
+
+
+class FileSink:
+    """Rewrites the raw interrupt/weight file, write-then-rename like the real producer."""
+
+    def __init__(self, path):
+        self.path, self.tmp = path, f"{path}.tmp"
+
+    def write(self, i, w):
+        with open(self.tmp, "w") as f:
+            f.write(f"{i},{w:.3f} kg")
+        os.replace(self.tmp, self.path)
+
+    def close(self):
+        pass
+
+
+class StdoutSink:
+    def write(self, i, w):
+        sys.stdout.write(f"{i},{w:.3f} kg\n")
+
+    def close(self):
+        sys.stdout.flush()
+
+
+def run(cell, items, sink, hz=50, seed=0, realtime=True, truth=None):
+    """Feed one scenario to `sink`, paced on the monotonic clock unless realtime is False.
+    With `truth`, one JSON line per item (landing time and weight) is written to it."""
+    t0, current = time.monotonic(), None
+    for t, i, w, k in trace(cell, items, hz, seed):
+        if realtime:
+            delay = t0 + t - time.monotonic()
+            if delay > 0: time.sleep(delay)
+        emitted = time.monotonic()  # taken before the write, so it never trails the reader's own timestamp
+        sink.write(i, w)
+        if k == current:
+            continue
+        if k is not None:
+            print(f"Item placed: {items[k].weight:.3f} kg", file=sys.stderr)
+            if truth:
+                truth.write(json.dumps({"item": k, "seed": seed, "t": round(t, 4),
+                                        "t_monotonic": emitted, "weight": items[k].weight}) + "\n")
+                truth.flush()
+        else:
+            print("Item removed", file=sys.stderr)
+        current = k
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Seeded load-cell simulator for the weighing pipeline")
+    ap.add_argument("--scenario", default="bouncy", choices=sorted(SCENARIOS))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--items", type=int, default=0, help="number of items (0: keep going)")
+    ap.add_argument("--hz", type=float, default=50, help="samples per second")
+    ap.add_argument("--idle", type=float, help="override seconds with an empty tray between items")
+    ap.add_argument("--hold", type=float, help="override seconds each item stays on the tray")
+    ap.add_argument("--min-weight", type=float, default=0.2)
+    ap.add_argument("--max-weight", type=float, default=1.0)
+    ap.add_argument("--out", choices=("pty", "file", "stdout"), default="pty")
+    ap.add_argument("--link", default=DEFAULT_LINK, help="pty: symlink to create for the slave end")
+    ap.add_argument("--file", help="file: raw interrupt/weight file to rewrite")
+    ap.add_argument("--ack", action="store_true", help="pty: acknowledge each received command with 'ACK <cmd>'")
+    ap.add_argument("--fast", action="store_true", help="emit as fast as possible instead of in real time")
+    ap.add_argument("--truth", help="append one JSON line per item (landing time, weight) to this file")
+    a = ap.parse_args(argv)
+
+    if a.out == "pty":
+        sink = PtySink(a.link, a.ack)
+        print(f"Scale simulator on {sink.name} (linked at {a.link}), {a.scenario} at {a.hz:g} Hz", file=sys.stderr)
+    elif a.out == "file":
+        if not a.file: ap.error("--out file needs --file")
+        sink = FileSink(a.file)
+    else:
+        sink = StdoutSink()
+    truth = open(a.truth, "a") if a.truth else None
+    try:
+        seed = a.seed
+        while True:
+            # Without --items, keep drawing fresh (still seeded) batches of items
+            cell, items = scenario(a.scenario, a.items or 20, seed, a.min_weight, a.max_weight, a.idle, a.hold)
+            run(cell, items, sink, a.hz, seed, not a.fast, truth)
+            if a.items: break
+            seed += 1
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        sink.close()
+        if truth: truth.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# serial_commands.py
+# Command channel from the GUI to the scale controller. The GUI sends each command
+# ("y" item detected, "z" image captured, "s" image saved) as one datagram on a
+# Unix socket; whichever process owns the serial port (serial_file_sender.py, or
+# the stability script when it reads the scale directly) runs a CommandServer
+# that queues them in order, paces them per command, drops only exact repeats of
+# the current state and, optionally, waits for the controller to acknowledge.
+import os, time, socket, logging
+from collections import deque
+
+DEFAULT_SOCKET = "/tmp/optiwaste_serial.sock"
+
+
+def socket_path(cfg):
+    return cfg.get("SERIAL_COMMAND_SOCKET") or DEFAULT_SOCKET
+
+
+def parse_gaps(spec, default=0.25):
+    """Milliseconds as "250" or "y:0,z:250,*:500" -> {command: seconds, "*": default}."""
+    gaps = {"*": default}
+    for part in str(spec).split(","):
+        if not part.strip():
+            continue
+        cmd, _, ms = part.rpartition(":")
+        gaps[cmd.strip() or "*"] = float(ms) / 1000
+    return gaps
+
+
+class CommandClient:
+    """GUI side. send() never blocks; if the server is not up yet, commands wait in
+    order in `pending` and go out on the next send() or flush()."""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.path = str(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.pending = deque()
+
+    def send(self, cmd):
+        self.pending.append((cmd, time.monotonic()))
+        return self.flush()
+
+    def flush(self):
+        while self.pending:
+            cmd, t = self.pending[0]
+            try:
+                # The enqueue time travels with the command so the server can report enqueue->wire latency
+                self.sock.sendto(f"{cmd} {t:.6f}".encode(), self.path)
+            except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+                break
+            self.pending.popleft()
+        return len(self.pending)
+
+    def close(self):
+        self.sock.close()
+
+
+class CommandServer:
+    """Serial side. Call poll() whenever the socket is readable or its return value (seconds
+    until the next action, None when idle) elapses; feed controller lines to ack()."""
+
+    def __init__(self, path, write, gaps=None, ack_timeout=0, ack_retries=2):
+        self.path, self.write = str(path), write
+        self.gaps = gaps or {"*": 0.25}
+        self.ack_timeout, self.ack_retries = ack_timeout, ack_retries
+        try:
+            os.unlink(self.path)  # stale socket from a previous run
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        self.queue = deque()
+        self.state, self.last_write = None, -float("inf")
+        self.awaiting = None  # (cmd, t_enqueued, deadline, attempts) while waiting for an ack
+        self.sent = self.coalesced = self.unacked = 0
+        self.latencies = deque(maxlen=200)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.sock.recv(256)
+            except BlockingIOError:
+                return
+            parts = data.decode(errors="replace").split()
+            if not parts:
+                continue
+            cmd, t = parts[0], float(parts[1]) if len(parts) > 1 else time.monotonic()
+            # A repeat of the state the controller is already in (or is about to be put in) is redundant
+            latest = self.queue[-1][0] if self.queue else self.awaiting[0] if self.awaiting else self.state
+            if cmd == latest:
+                self.coalesced += 1
+                continue
+            self.queue.append((cmd, t))
+
+    def _send(self, cmd, t_enq, attempts=1):
+        self.write(cmd.encode("utf-8"))
+        wire = time.monotonic()
+        self.last_write = wire
+        if attempts == 1:
+            self.sent += 1
+            self.latencies.append(wire - t_enq)
+            logging.info(f"Sent '{cmd}' to serial port {(wire - t_enq) * 1000:.1f} ms after enqueue")
+        else:
+            logging.warning(f"Resent '{cmd}' (attempt {attempts})")
+        if self.ack_timeout > 0:
+            self.awaiting = (cmd, t_enq, wire + self.ack_timeout, attempts)
+        else:
+            self.state = cmd
+
+    def ack(self, line):
+        """Controller line: the echoed command, optionally prefixed by ACK."""
+        if self.awaiting and line.strip().lower().removeprefix("ack").strip() == self.awaiting[0]:
+            self.state, self.awaiting = self.awaiting[0], None
+
+    def poll(self):
+        self._receive()
+        while True:
+            now = time.monotonic()
+            if self.awaiting:
+                cmd, t_enq, deadline, attempts = self.awaiting
+                if now < deadline:
+                    return deadline - now
+                if attempts <= self.ack_retries:
+                    # Counted before the write: if it raises, this attempt is used up and the next waits ack_timeout
+                    self.awaiting = (cmd, t_enq, now + self.ack_timeout, attempts + 1)
+                    self._send(cmd, t_enq, attempts + 1)
+                    continue
+                self.unacked += 1
+                logging.error(f"No ack for '{cmd}' after {attempts} attempts")
+                self.state, self.awaiting = cmd, None
+            if not self.queue:
+                return None
+            cmd, t_enq = self.queue[0]
+            wait = self.last_write + self.gaps.get(cmd, self.gaps["*"]) - now
+            if wait > 0:
+                return wait
+            self._send(cmd, t_enq)
+            self.queue.popleft()  # only once written: a failed write leaves the command first in line
+
+    def report(self):
+        lat = sorted(self.latencies)
+        p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+        return (f"sent={self.sent} coalesced={self.coalesced} unacked={self.unacked} "
+                f"latency p50={p(0.5):.1f} ms p95={p(0.95):.1f} ms max={p(1.0):.1f} ms")
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -1,67 +1,85 @@
 # serial_file_sender.py
+# Owns the controller's serial port for outgoing commands. The GUI sends y/z/s over
+# the command socket (serial_commands.py); they are written in order, paced per
+# command, and optionally acknowledged by the controller.
 import serial
 import time
 import os
-import queue
+import select
+import logging
 import threading
+from serial_commands import CommandServer, socket_path, parse_gaps
+from stage_trace import config_file, install_sigterm
 
 SERIAL_PORT = '/dev/ttyACM0'
 BAUDRATE = 115200
-INPUT_FILE = '/home/pi/opti1/serialinput.txt'
-SEND_DELAY = 3  # seconds between sends
 
-def serial_worker(ser, q):
-    """Continuously send characters from the queue with a delay."""
-    while True:
-        char = q.get()  # blocking wait for next item
-        if char is None:  # sentinel to exit
-            break
-        try:
-            ser.write(char.encode('utf-8'))
-            print(f"Sent '{char}' to serial port.")
-        except Exception as e:
-            print(f"Error sending to serial: {e}")
-        time.sleep(SEND_DELAY)  # ensure gap
-        q.task_done()
+def load_config(file="config.txt"):
+    cfg = {}
+    with open(config_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), file))) as f:
+        for line in f:
+            if "=" in line:
+                k, v = line.strip().split("=", 1)
+                cfg[k] = v
+    return cfg
 
-def main():
-    ser = None
+cfg = load_config()
+MIN_GAP = parse_gaps(cfg.get("SERIAL_MIN_GAP_MS", "250"))       # replaces the fixed 3 s SEND_DELAY
+ACK_TIMEOUT = float(cfg.get("SERIAL_ACK_TIMEOUT_MS", 0)) / 1000  # 0: controller does not acknowledge
+ACK_RETRIES = int(cfg.get("SERIAL_ACK_RETRIES", 2))
+REPORT_INTERVAL = 60
+
+def main(stop=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    stop = stop or threading.Event()  # set by supervisor.py to shut this service down
+    ser = server = None
     try:
         ser = serial.Serial(
-            port=SERIAL_PORT,
-            baudrate=BAUDRATE,
+            port=cfg.get("SCALE_PORT", SERIAL_PORT),
+            baudrate=int(cfg.get("SCALE_BAUD", BAUDRATE)),
             bytesize=serial.EIGHTBITS,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
-            timeout=1
+            timeout=0
         )
-        time.sleep(2)  # allow connection setup
-        print(f"Serial connected at {SERIAL_PORT} ({BAUDRATE} baud).")
-
-        q = queue.Queue()
-        threading.Thread(target=serial_worker, args=(ser, q), daemon=True).start()
+        stop.wait(2)  # allow connection setup
+        print(f"Serial connected at {ser.port} ({ser.baudrate} baud).")
 
-        last_char = None
-        while True:
+        server = CommandServer(socket_path(cfg), ser.write, MIN_GAP, ACK_TIMEOUT, ACK_RETRIES)
+        print(f"Listening for commands on {server.path}")
+        watch = [server, ser] if ACK_TIMEOUT > 0 else [server]
+        buf, next_report = b"", time.monotonic() + REPORT_INTERVAL
+        while not stop.is_set():
             try:
-                if os.path.exists(INPUT_FILE):
-                    with open(INPUT_FILE, 'r') as f:
-                        content = f.read().strip()
-                        if content:
-                            if content != last_char:
-                                q.put(content)  # enqueue for serial transmission
-                                last_char = content
-                time.sleep(0.1)
-            except Exception as e:
-                print(f"Error reading file: {e}")
-                time.sleep(1)
+                timeout = server.poll()
+                ready, _, _ = select.select(watch, [], [], 1.0 if timeout is None else min(timeout, 1.0))
+                if ser in ready:
+                    buf += ser.read(ser.in_waiting or 1)
+                    *lines, buf = buf.split(b"\n")
+                    for line in lines:
+                        server.ack(line.decode(errors="replace"))
+            except (OSError, ValueError) as e:
+                # e.g. the controller was unplugged: commands stay queued and are written once the port is back
+                logging.error(f"Serial port error: {e}; reopening")
+                stop.wait(1)
+                try:
+                    ser.close()
+                    ser.open()
+                except (OSError, ValueError):
+                    pass
+            if time.monotonic() >= next_report:
+                logging.info(f"Serial commands: {server.report()}")
+                next_report = time.monotonic() + REPORT_INTERVAL
 
     except KeyboardInterrupt:
         print("Program terminated by user.")
     finally:
+        if server:
+            logging.info(f"Serial commands: {server.report()}")
+            server.close()
         if ser and ser.is_open:
             ser.close()
             print("Serial connection closed.")
 
 if __name__ == "__main__":
-    main()
+    main(install_sigterm(threading.Event()))
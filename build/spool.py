@@ -0,0 +1,173 @@
+# spool.py
+# Keeps saved/ and temp/ within a disk budget on the SD card. Captures are stored
+# in one sub-directory per capture date, so usage is re-scanned only for shards
+# whose directory changed since the last check. When the spool exceeds its byte
+# or file budget, or the card runs low on space, pending captures are degraded
+# oldest-first by the configured eviction stages: re-encode smaller
+# ("downscale"), keep a thumbnail only ("thumbnail"), then delete ("oldest").
+# Each step is recorded in the catalog. Orphans left in temp/ by an earlier run
+# are reclaimed in one pass at start-up, and captures it had already renamed into
+# saved/ are handed back to the uploader.
+import logging, os
+from datetime import datetime
+from pathlib import Path
+from transcode import Profile, encode
+
+STAGES = {"downscale": 1, "thumbnail": 2, "oldest": 3}  # spool level each stage brings a capture to
+LOW_WATER = 0.9  # evict down to this fraction of the budget, so one new capture does not trigger it again
+
+
+def shard(root, when=None):
+    """Date shard directory for a capture taken at `when` (a datetime, default now)."""
+    return Path(root) / (when or datetime.now()).strftime("%Y-%m-%d")
+
+
+def name_weight(path):
+    """Weight from a capture name like OptiA1_18-24-58_2025-08-25_0x92_17.jpg, or None."""
+    try:
+        return float(Path(path).stem.split("_")[-2].replace("x", "."))
+    except (IndexError, ValueError):
+        return None
+
+
+def reclaim_temp(temp_dir, catalog=None, save_dir=None):
+    """Delete everything in temp/: at start-up no capture is in progress, so these are captures whose
+    stable weight never came (or half-written .part files). Returns (files, bytes) reclaimed.
+
+    Catalog rows still 'capturing' are abandoned, unless the file at their recorded path is in save_dir:
+    the run stopped between the rename and mark_saved(), so the row goes back to 'saved' instead."""
+    files = size = 0
+    try:
+        entries = list(os.scandir(temp_dir))
+    except FileNotFoundError:
+        entries = []
+    for e in entries:
+        if not e.is_file(follow_symlinks=False):
+            continue
+        try:
+            n = e.stat().st_size
+            os.unlink(e.path)
+            files, size = files + 1, size + n
+        except OSError as err:
+            logging.warning(f"Could not reclaim {e.name} from temp: {err}")
+    if catalog is not None:
+        for row in catalog.capturing() if save_dir is not None else ():
+            if row["path"] and (Path(save_dir) / row["path"]).is_file():
+                catalog.mark_recovered(row["id"], name_weight(row["path"]))
+                logging.info(f"Recovered capture {row['id']} saved as {row['path']} before the last shutdown")
+        catalog.abandon_capturing()
+    return files, size
+
+
+class Spool:
+    def __init__(self, root, catalog, max_bytes, max_files, min_free=0, policy="downscale,thumbnail,oldest",
+                 downscale="max_dim=1280 quality=70", thumbnail="max_dim=320 quality=60"):
+        self.root, self.catalog = Path(root), catalog
+        self.max_bytes, self.max_files, self.min_free = max_bytes, max_files, min_free
+        self.policy = [s.strip() for s in policy.split(",") if s.strip()]
+        unknown = [s for s in self.policy if s not in STAGES]
+        if unknown:
+            raise ValueError(f"unknown spool eviction stage: {', '.join(unknown)}")
+        self.profiles = {1: Profile.parse(downscale), 2: Profile.parse(thumbnail)}
+        self._shards = {}  # shard name -> (dir mtime_ns, bytes, files)
+
+    def usage(self):
+        """(bytes, files) in the spool; only shards whose directory changed are listed again."""
+        total = count = 0
+        seen = {}
+        loose = []
+        for e in os.scandir(self.root):
+            if e.is_dir(follow_symlinks=False):
+                mtime = e.stat().st_mtime_ns
+                cached = self._shards.get(e.name)
+                if cached is None or cached[0] != mtime:
+                    b = n = 0
+                    for f in os.scandir(e.path):
+                        if f.is_file(follow_symlinks=False):
+                            b, n = b + f.stat().st_size, n + 1
+                    cached = (mtime, b, n)
+                seen[e.name] = cached
+                total, count = total + cached[1], count + cached[2]
+            elif e.is_file(follow_symlinks=False):
+                loose.append(e)  # flat files from before sharding
+        self._shards = seen
+        for e in loose:
+            total, count = total + e.stat().st_size, count + 1
+        return total, count
+
+    def free_bytes(self):
+        st = os.statvfs(self.root)
+        return st.f_bavail * st.f_frsize
+
+    def excess(self):
+        """(bytes, files) to reclaim to get back to the low-water mark; both 0 when within budget."""
+        used, files = self.usage()
+        over_bytes = used > self.max_bytes or (self.min_free and self.free_bytes() < self.min_free)
+        over_files = files > self.max_files
+        if not (over_bytes or over_files):
+            return 0, 0
+        need = max(used - self.max_bytes * LOW_WATER, self.min_free / LOW_WATER - self.free_bytes() if self.min_free else 0)
+        return max(0, int(need)) if over_bytes else 0, max(0, files - int(self.max_files * LOW_WATER)) if over_files else 0
+
+    def enforce(self):
+        """Apply the eviction stages until the spool is back within budget. Returns {stage: captures}."""
+        need_bytes, need_files = self.excess()
+        if not (need_bytes or need_files):
+            return {}
+        logging.warning(f"Spool over budget: {need_bytes / 1e6:.1f} MB and {need_files} files to reclaim")
+        done = {}
+        for stage in self.policy:
+            level = STAGES[stage]
+            if stage != "oldest" and need_bytes <= 0:
+                continue  # re-encoding frees bytes, not inodes
+            while need_bytes > 0 or (stage == "oldest" and need_files > 0):
+                rows = self.catalog.oldest_pending(below_level=level, limit=50)
+                if not rows:
+                    break
+                for row in rows:
+                    freed = self._degrade(row, level)
+                    need_bytes -= freed
+                    done[stage] = done.get(stage, 0) + 1
+                    if stage == "oldest":
+                        need_files -= 1
+                    if need_bytes <= 0 and (stage != "oldest" or need_files <= 0):
+                        break
+        self._remove_empty_shards()
+        logging.warning(f"Spool eviction: {done}")
+        return done
+
+    def _degrade(self, row, level):
+        """Bring one capture to `level`; returns the bytes freed."""
+        path = self.root / row["path"]
+        try:
+            before = path.stat().st_size
+        except FileNotFoundError:
+            self.catalog.mark_missing(row["id"])
+            return 0
+        if level == STAGES["oldest"]:
+            path.unlink()
+            self.catalog.mark_evicted(row["id"])
+            logging.warning(f"Evicted {row['path']} ({before / 1e3:.0f} kB) unsent")
+            return before
+        out = path.with_name(path.name + ".spool")
+        try:
+            after = encode(path, out, None, self.profiles[level])[0]
+            if after < before:
+                os.replace(out, path)  # same name, so the catalog and upload queue still point at it
+            else:
+                out.unlink()
+                after = before
+        except Exception as e:
+            logging.error(f"Spool re-encode failed for {row['path']}: {e}")
+            after = before
+        self.catalog.set_spool_level(row["id"], level)
+        return before - after
+
+    def _remove_empty_shards(self):
+        today = shard(self.root).name
+        for e in os.scandir(self.root):
+            if e.is_dir(follow_symlinks=False) and e.name != today:
+                try:
+                    os.rmdir(e.path)  # only succeeds when empty
+                except OSError:
+                    pass
@@ -0,0 +1,147 @@
+# stability.py
+# Streaming weight-stability detection. A MonotonicWindow keeps the min/max/mean of
+# the last N samples in O(1) amortised time per sample inside a fixed-size array;
+# StabilityDetector declares a weight stable as soon as that window has stayed
+# within THRESHOLD for a minimum dwell time, instead of after a fixed duration.
+# SettleEstimator optionally predicts the settled weight before the window is flat.
+from array import array
+from collections import deque
+
+
+class MonotonicWindow:
+    """Sliding window over the last `size` samples with O(1) min, max and mean."""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = array("d", bytes(8 * size))  # fixed-size ring, no unbounded history
+        self.count, self.total = 0, 0.0
+        self.maxq, self.minq = deque(), deque()  # (index, value), values monotonically decreasing / increasing
+
+    def clear(self):
+        self.count, self.total = 0, 0.0
+        self.maxq.clear()
+        self.minq.clear()
+
+    def push(self, v):
+        i = self.count
+        if i >= self.size:
+            self.total -= self.values[i % self.size]
+        self.values[i % self.size] = v
+        self.total += v
+        self.count += 1
+        while self.maxq and self.maxq[-1][1] <= v:
+            self.maxq.pop()
+        self.maxq.append((i, v))
+        while self.minq and self.minq[-1][1] >= v:
+            self.minq.pop()
+        self.minq.append((i, v))
+        oldest = i - self.size + 1
+        if self.maxq[0][0] < oldest:
+            self.maxq.popleft()
+        if self.minq[0][0] < oldest:
+            self.minq.popleft()
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    @property
+    def max(self):
+        return self.maxq[0][1]
+
+    @property
+    def min(self):
+        return self.minq[0][1]
+
+    @property
+    def spread(self):
+        return self.maxq[0][1] - self.minq[0][1]
+
+    @property
+    def mean(self):
+        return self.total / len(self)
+
+    def samples(self):
+        """Window contents, oldest first."""
+        n = len(self)
+        return [self.values[i % self.size] for i in range(self.count - n, self.count)]
+
+
+class StabilityDetector:
+    """Feed samples with update(t, w) while an item is on the scale.
+
+    Returns the settled weight (window mean) once the window of `window` samples has
+    spread <= `threshold` continuously for `min_dwell` seconds, otherwise None."""
+
+    def __init__(self, threshold=0.05, window=10, min_dwell=0.4):
+        self.threshold, self.min_dwell = threshold, min_dwell
+        self.window = MonotonicWindow(window)
+        self.start_time, self.within_since = None, None
+
+    def start(self, t):
+        self.window.clear()
+        self.start_time, self.within_since = t, None
+
+    def update(self, t, w):
+        self.window.push(w)
+        if not self.window.full or self.window.spread > self.threshold:
+            self.within_since = None
+            return None
+        if self.within_since is None:
+            self.within_since = t
+        if t - self.within_since >= self.min_dwell:
+            return self.window.mean
+        return None
+
+
+class SettleEstimator:
+    """Forecasts the settled weight from the load cell's decaying oscillation.
+
+    Samples are exponentially smoothed, turning points are picked out with a
+    hysteresis band (so noise does not create extrema), and every three consecutive
+    extrema e0, e1, e2 give an Aitken extrapolation of the geometric decay:
+    W = (e0*e2 - e1^2) / (e0 + e2 - 2*e1). update() returns (estimate, confidence);
+    confidence rises toward 1 as the last `agree` forecasts converge within `threshold`."""
+
+    def __init__(self, threshold=0.05, hysteresis=None, alpha=0.5, agree=3):
+        self.threshold, self.alpha = threshold, alpha
+        self.hysteresis = threshold / 4 if hysteresis is None else hysteresis
+        self.extrema, self.estimates = deque(maxlen=3), deque(maxlen=agree)
+        self.start()
+
+    def start(self):
+        self.smoothed, self.direction, self.candidate = None, 0, None
+        self.extrema.clear()
+        self.estimates.clear()
+
+    def update(self, w):
+        s = self.smoothed = w if self.smoothed is None else self.smoothed + self.alpha * (w - self.smoothed)
+        if self.candidate is None:
+            self.candidate = s
+        elif self.direction == 0:
+            if abs(s - self.candidate) > self.hysteresis:
+                self.direction, self.candidate = (1 if s > self.candidate else -1), s
+        elif (s - self.candidate) * self.direction > 0:
+            self.candidate = s
+        elif abs(s - self.candidate) > self.hysteresis:
+            self._extremum(self.candidate)
+            self.direction, self.candidate = -self.direction, s
+        if len(self.estimates) < self.estimates.maxlen:
+            return (self.estimates[-1] if self.estimates else None), 0.0
+        spread = max(self.estimates) - min(self.estimates)
+        return sum(self.estimates) / len(self.estimates), max(0.0, 1.0 - 2 * spread / self.threshold)
+
+    def _extremum(self, e):
+        self.extrema.append(e)
+        if len(self.extrema) < 3:
+            return
+        e0, e1, e2 = self.extrema
+        den = e0 + e2 - 2 * e1
+        if abs(den) > 1e-9:
+            est = (e0 * e2 - e1 * e1) / den
+            # A forecast outside the last swing means the decay is not geometric (e.g. a hand on the tray)
+            if min(self.extrema) <= est <= max(self.extrema):
+                self.estimates.append(est)
@@ -0,0 +1,43 @@
+# stage_trace.py
+# Optional per-item stage timestamps for benchmark.py. When TRACE_FILE is set in
+# the config, each process appends one JSON line per stage it reaches
+# ({"stage", "item", "t" (CLOCK_MONOTONIC, shared by all processes), "pid", ...});
+# callers that know when the event really happened pass their own t.
+# Each line is a single O_APPEND write, so several processes can share the file.
+# Without TRACE_FILE, mark() is a no-op.
+import os, json, signal, time
+
+
+class StageTrace:
+    def __init__(self, path=None):
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644) if path else None
+
+    def mark(self, stage, item=None, **fields):
+        if self.fd is None:
+            return
+        rec = {"stage": stage, "item": item, "t": time.monotonic(), "pid": os.getpid(), **fields}
+        try:
+            os.write(self.fd, (json.dumps(rec) + "\n").encode())
+        except OSError:
+            pass  # tracing must never take the pipeline down
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def stage_trace(cfg):
+    return StageTrace(cfg.get("TRACE_FILE") or None)
+
+
+def config_file(default):
+    """Config path, overridable with OPTIWASTE_CONFIG (used by benchmark.py to run against a temp tree)."""
+    return os.environ.get("OPTIWASTE_CONFIG") or default
+
+
+def install_sigterm(stop):
+    """Set the service's stop Event on SIGTERM, which is how supervisor.py ends a service in processes
+    mode; without it Python dies on the spot and the service's cleanup never runs. Returns stop."""
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    return stop
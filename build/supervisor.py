@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# supervisor.py
+# Runs the station's background services for gui14.py: the stability script, the
+# serial command sender and the uploader. SERVICE_MODE=threads (default) runs all
+# of them in this one interpreter, each in its own thread, so the Pi pays for one
+# Python start-up and one set of imports instead of three. SERVICE_MODE=processes
+# keeps each in its own interpreter, as before, for isolation. Either way an
+# asyncio loop restarts a service that crashes (with backoff) and reports the
+# services' health, RSS and CPU to the log and to a JSON status file.
+import asyncio, importlib, json, logging, os, signal, sys, threading, time
+from pathlib import Path
+from stage_trace import config_file
+from upload_scheduler import retry_delay
+from transcode import Profile, start_workers, stop_workers
+
+BASE = Path(__file__).parent
+cfg = {k.strip(): v.strip() for k, v in (line.split("=", 1) for line in open(config_file(BASE / "config.txt")) if "=" in line)}
+MODE = cfg.get("SERVICE_MODE", "threads")
+REPORT_INTERVAL = float(cfg.get("SUPERVISOR_REPORT_INTERVAL", 60))
+HEALTH_TIMEOUT = float(cfg.get("SUPERVISOR_HEALTH_TIMEOUT", 30))  # a thread that has not checked its stop flag for this long is reported stalled
+# The uploader checks its flag once per image, and one image may take a full connect + read timeout on a slow link
+HEALTH_TIMEOUTS = {"upload": HEALTH_TIMEOUT + float(cfg.get("UPLOAD_CONNECT_TIMEOUT", 5)) + float(cfg.get("UPLOAD_READ_TIMEOUT", 30))}
+STATUS_FILE = BASE / cfg.get("SUPERVISOR_STATUS", "supervisor_status.json")
+STOP_GRACE = 5.0
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+# name, module, entry point, run it?
+SERVICES = [
+    ("stability", "interrupt_weightread_stability", "main", True),
+    ("serial", "serial_file_sender", "main", cfg.get("WEIGHT_SOURCE", "file") != "serial"),  # in serial mode the stability service owns the port
+    ("upload", "fileupload", "run_upload_service", True),
+]
+
+
+class Lifeline(threading.Event):
+    """Stop flag handed to a service thread. Services check it on every loop, so each check doubles as a heartbeat."""
+
+    def __init__(self):
+        super().__init__()
+        self.beat, self.waiting = time.monotonic(), False
+
+    def is_set(self):
+        self.beat = time.monotonic()
+        return super().is_set()
+
+    def wait(self, timeout=None):
+        self.waiting = True  # a service sleeping on its stop flag is idle, not stuck
+        try:
+            return super().wait(timeout)
+        finally:
+            self.waiting, self.beat = False, time.monotonic()
+
+
+def proc_stats(pid="self"):
+    """(rss bytes, cpu seconds) of a process from /proc, or None where there is no /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages * os.sysconf("SC_PAGE_SIZE"), (int(fields[11]) + int(fields[12])) / CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def thread_cpu(tid):
+    try:
+        with open(f"/proc/self/task/{tid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def child_pids(pid):
+    """Direct children of pid (e.g. transcoding workers, the simulator)."""
+    pids = []
+    for d in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if d.isdigit():
+            try:
+                with open(f"/proc/{d}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(d))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+class Service:
+    def __init__(self, name, module, entry):
+        self.name, self.module, self.entry = name, module, entry
+        self.state, self.restarts, self.last_error, self.started = "starting", 0, None, None
+        self.lifeline, self.proc = None, None
+
+    # --- threads mode ---
+    async def run_thread(self):
+        loop, done = asyncio.get_running_loop(), asyncio.get_running_loop().create_future()
+        self.lifeline = Lifeline()
+
+        def target():
+            err = None
+            try:
+                getattr(importlib.import_module(self.module), self.entry)(self.lifeline)
+            except BaseException as e:  # SystemExit too: a service must never take the process down
+                err = e
+                logging.exception(f"Service {self.name} crashed")
+            loop.call_soon_threadsafe(done.set_result, err)
+
+        threading.Thread(target=target, name=self.name, daemon=True).start()
+        err = await done
+        return None if err is None else repr(err)
+
+    # --- processes mode ---
+    async def run_process(self):
+        self.proc = await asyncio.create_subprocess_exec(sys.executable, str(BASE / f"{self.module}.py"))
+        code = await self.proc.wait()
+        return None if code == 0 else f"exit code {code}"
+
+    def stop(self):
+        if self.lifeline:
+            self.lifeline.set()
+        if self.proc and self.proc.returncode is None:
+            self.proc.terminate()
+
+    async def supervise(self, stopping):
+        failures = 0
+        while not stopping.is_set():
+            self.state, self.started = "running", time.monotonic()
+            logging.info(f"Starting {self.name} ({MODE})")
+            error = await (self.run_thread() if MODE == "threads" else self.run_process())
+            if stopping.is_set():
+                break
+            # A service that ran for a while before failing starts its backoff over
+            failures = 1 if time.monotonic() - self.started > 60 else failures + 1
+            self.restarts, self.last_error = self.restarts + 1, error or "exited"
+            delay = retry_delay(failures, base=1, cap=60)
+            self.state = "restarting"
+            logging.error(f"Service {self.name} stopped ({self.last_error}); restart {self.restarts} in {delay:.1f} s")
+            try:
+                await asyncio.wait_for(stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self.state = "stopped"
+
+    def health(self):
+        """'ok', 'stalled' (threads: no stop-flag check for the service's health timeout) or the supervision state."""
+        if self.state != "running":
+            return self.state
+        if self.lifeline and not self.lifeline.waiting and time.monotonic() - self.lifeline.beat > HEALTH_TIMEOUTS.get(self.name, HEALTH_TIMEOUT):
+            return "stalled"
+        return "ok"
+
+
+def snapshot(services, prev, dt):
+    """Per-service and process-wide RSS/CPU since the previous snapshot."""
+    report, marks = {"mode": MODE, "time": time.time(), "services": {}}, {}
+    pct = lambda cpu, key: max(0.0, cpu - prev.get(key, cpu)) / dt * 100 if dt else 0.0  # finished pool threads take their CPU time with them
+    me = proc_stats()
+    if MODE == "threads":
+        tids = {}
+        for t in threading.enumerate():
+            tids.setdefault(t.name.split("_")[0], []).append(t.native_id)  # pool threads such as upload_3 count for upload
+        for s in services:
+            cpu = sum(c for c in (thread_cpu(tid) for tid in tids.get(s.name, [])) if c is not None)
+            marks[s.name] = cpu
+            report["services"][s.name] = {"health": s.health(), "restarts": s.restarts, "cpu_pct": round(pct(cpu, s.name), 1)}
+    else:
+        for s in services:
+            st = proc_stats(s.proc.pid) if s.proc and s.proc.returncode is None else None
+            entry = {"health": s.health(), "restarts": s.restarts}
+            if st:
+                marks[s.name] = st[1]
+                entry.update(rss_mb=round(st[0] / 1e6, 1), cpu_pct=round(pct(st[1], s.name), 1))
+            report["services"][s.name] = entry
+    for s in services:
+        if s.last_error:
+            report["services"][s.name]["last_error"] = s.last_error
+    if me:
+        marks["supervisor"] = me[1]
+        report["supervisor"] = {"rss_mb": round(me[0] / 1e6, 1), "cpu_pct": round(pct(me[1], "supervisor"), 1)}
+    # Everything this station runs in the background: this process, its services and their helpers
+    own = [s.proc.pid for s in services if s.proc and s.proc.returncode is None]
+    helpers = [p for pid in [os.getpid(), *own] for p in child_pids(pid) if p not in own]
+    total = [st for st in (proc_stats(p) for p in helpers + own) if st] + ([me] if me else [])
+    report["total"] = {"processes": len(total), "rss_mb": round(sum(st[0] for st in total) / 1e6, 1)}
+    return report, marks
+
+
+async def report_loop(services, stopping):
+    prev, last = {}, time.monotonic()
+    while True:
+        try:
+            await asyncio.wait_for(stopping.wait(), REPORT_INTERVAL)
+            break
+        except asyncio.TimeoutError:
+            pass
+        now = time.monotonic()
+        report, prev = snapshot(services, prev, now - last)
+        last = now
+        parts = [f"{n} {v['health']} cpu {v.get('cpu_pct', 0):.1f}%" + (f" rss {v['rss_mb']} MB" if "rss_mb" in v else "")
+                 for n, v in report["services"].items()]
+        logging.info(f"Services ({MODE}): " + ", ".join(parts) + f"; total {report['total']['processes']} processes, "
+                     f"{report['total']['rss_mb']} MB RSS")
+        tmp = STATUS_FILE.with_name(STATUS_FILE.name + ".tmp")
+        tmp.write_text(json.dumps(report, indent=1))
+        os.replace(tmp, STATUS_FILE)
+
+
+async def main():
+    logging.basicConfig(filename=str(BASE / cfg.get("SUPERVISOR_LOG", "supervisor.log")), level=logging.INFO,
+                        format="%(asctime)s - %(threadName)s - %(levelname)s - %(message)s")
+    if MODE == "threads":
+        # The uploader kept its own log as a separate process; keep it, for its threads only
+        handler = logging.FileHandler(str(BASE / cfg.get("UPLOADER_LOG", "uploader.log")))
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        handler.addFilter(lambda r: r.threadName.split("_")[0] == "upload")
+        logging.getLogger().addHandler(handler)
+    services = [Service(n, m, e) for n, m, e, on in SERVICES if on]
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            pass  # Windows: the GUI's CTRL_BREAK/terminate ends the process instead
+    logging.info(f"Supervisor started in {MODE} mode: {', '.join(s.name for s in services)}")
+    tasks = [asyncio.create_task(s.supervise(stopping)) for s in services]
+    reporter = asyncio.create_task(report_loop(services, stopping))
+    await stopping.wait()
+    logging.info("Stopping services")
+    for s in services:
+        s.stop()
+    done, pending = await asyncio.wait(tasks, timeout=STOP_GRACE)
+    for s in services:
+        if s.proc and s.proc.returncode is None:
+            s.proc.kill()
+    if pending:
+        logging.warning(f"Services still running after {STOP_GRACE:.0f} s: {len(pending)}; exiting anyway")
+    reporter.cancel()
+
+
+if __name__ == "__main__":
+    if MODE == "threads" and Profile.parse(cfg.get("UPLOAD_PROFILE", "original")) is not None:
+        # The uploader's encoding workers are forked now, while this is the only thread (and before asyncio
+        # installs its signal handling); the upload service thread picks the running pool up
+        start_workers(int(cfg.get("TRANSCODE_WORKERS", 2)))
+    try:
+        asyncio.run(main())
+    finally:
+        stop_workers()
@@ -0,0 +1,61 @@
+# synthetic_camera.py
+# Stand-in for Picamera2 with the subset of its API gui14.py and CaptureWorker use,
+# selected with CAMERA=synthetic. Frames are a fixed gradient with a slowly moving
+# block, paced at the configured FrameDurationLimits, so the preview, the frame
+# ring and the capture path do real work on a machine without a camera.
+import time
+import numpy as np
+
+
+class SyntheticCamera:
+    sensor_resolution = (2304, 1296)
+
+    def __init__(self, camera_num=0):
+        self.size, self.channels, self.frame_s = (640, 480), 3, 1 / 30
+        self.background, self.n, self.next_frame = None, 0, 0.0
+
+    def create_preview_configuration(self, main=None, lores=None, controls=None, transform=None, **kwargs):
+        config = {"main": dict(main or {"size": (640, 480), "format": "RGB888"}), "controls": dict(controls or {})}
+        if lores:
+            config["lores"] = dict(lores)
+        return config
+
+    def configure(self, config):
+        if config.get("lores"):
+            # Mapped lores buffers need the real libcamera requests; callers fall back to a single stream
+            raise RuntimeError("synthetic camera has a single stream")
+        self.size = tuple(config["main"]["size"])
+        self.channels = 4 if config["main"].get("format", "RGB888").startswith("X") else 3
+        self.set_controls(config.get("controls", {}))
+        w, h = self.size
+        y, x = np.mgrid[0:h, 0:w]
+        bg = np.empty((h, w, self.channels), np.uint8)
+        bg[..., 0], bg[..., 1], bg[..., 2] = x * 255 // max(1, w - 1), y * 255 // max(1, h - 1), 96
+        if self.channels == 4:
+            bg[..., 3] = 255
+        self.background = bg
+
+    def set_controls(self, controls):
+        if "FrameDurationLimits" in controls:
+            self.frame_s = controls["FrameDurationLimits"][0] / 1_000_000
+
+    def start(self):
+        self.next_frame = time.monotonic()
+
+    def stop(self):
+        pass
+
+    def capture_array(self, name="main"):
+        self.next_frame += self.frame_s
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_frame = time.monotonic()
+        frame = self.background.copy()
+        w, h = self.size
+        b = max(8, min(w, h) // 8)
+        x = (self.n * 4) % max(1, w - b)
+        frame[h // 3:h // 3 + b, x:x + b, :3] = 255
+        self.n += 1
+        return frame
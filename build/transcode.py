@@ -0,0 +1,176 @@
+# transcode.py
+# Upload preparation for fileupload.py: re-encodes saved captures to a smaller
+# upload profile (max dimension, JPEG quality, progressive/optimized Huffman or
+# WebP, optional thumbnail) in a pool of niced worker processes, so the encoding
+# neither holds the GIL of the upload threads nor competes with the GUI. Results
+# are cached by content hash + profile, so a retried upload never re-encodes.
+import hashlib, logging, multiprocessing, os, time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+FORMATS = {"jpeg": (".jpg", "image/jpeg"), "webp": (".webp", "image/webp")}
+_pool = None  # the encoding workers, one pool per process shared by every Transcoder
+
+
+@dataclass(frozen=True)
+class Profile:
+    max_dim: int = 0            # px on the long side, 0 keeps the captured size
+    quality: int = 85
+    format: str = "jpeg"        # jpeg or webp
+    progressive: bool = True    # jpeg only
+    optimize: bool = True       # jpeg only: optimized Huffman tables
+    thumb: int = 0              # px on the long side of a thumbnail sent alongside, 0 for none
+    thumb_quality: int = 70
+
+    @classmethod
+    def parse(cls, spec):
+        """'max_dim=1600 quality=80 thumb=320' -> Profile; '' or 'original' -> None (upload the file as saved)."""
+        spec = (spec or "").strip()
+        if spec in ("", "original"):
+            return None
+        types = {f.name: f.type for f in fields(cls)}
+        kw = {}
+        for part in spec.replace(",", " ").split():
+            k, v = part.split("=", 1)
+            if k not in types:
+                raise ValueError(f"unknown upload profile setting: {k}")
+            kw[k] = v.lower() in ("1", "true", "yes") if types[k] is bool else int(v) if types[k] is int else v
+        p = cls(**kw)
+        if p.format not in FORMATS:
+            raise ValueError(f"unknown upload format: {p.format}")
+        return p
+
+    @property
+    def key(self):
+        return hashlib.sha1(repr(self).encode()).hexdigest()[:8]
+
+    @property
+    def ext(self):
+        return FORMATS[self.format][0]
+
+    @property
+    def mime(self):
+        return FORMATS[self.format][1]
+
+
+@dataclass
+class Prepared:
+    path: Path              # what to upload (the original if re-encoding did not make it smaller)
+    thumb: Path = None
+    bytes_in: int = 0
+    bytes_out: int = 0
+    thumb_bytes: int = 0
+    cpu: float = 0.0        # s of worker CPU spent encoding, 0 for a cache hit
+    cached: bool = False
+    mime: str = "image/jpeg"
+    cache_files: tuple = ()
+
+
+def _save(im, path, profile, quality):
+    tmp = path.with_name(path.name + ".tmp")
+    if profile.format == "webp":
+        im.save(tmp, "WEBP", quality=quality, method=4)
+    else:
+        im.save(tmp, "JPEG", quality=quality, progressive=profile.progressive, optimize=profile.optimize)
+    os.replace(tmp, path)  # the cache only ever holds complete files
+    return path.stat().st_size
+
+
+def encode(src, out, thumb, profile):
+    """Runs in a worker process. Returns (bytes_out, thumb_bytes, cpu seconds)."""
+    from PIL import Image
+    cpu = time.process_time()
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        if profile.max_dim and max(im.size) > profile.max_dim:
+            im.thumbnail((profile.max_dim, profile.max_dim), Image.LANCZOS)
+        size = _save(im, out, profile, profile.quality)
+        thumb_size = 0
+        if thumb is not None:
+            im.thumbnail((profile.thumb, profile.thumb), Image.BILINEAR)
+            thumb_size = _save(im, thumb, profile, profile.thumb_quality)
+    return size, thumb_size, time.process_time() - cpu
+
+
+def _lower_priority(niceness):
+    try:
+        os.nice(niceness)
+    except OSError:
+        pass
+
+
+def start_workers(workers=2, niceness=10):
+    """Start the process's encoding workers, if not already running, and return the pool.
+
+    The workers are forked, since a spawned worker would re-run the uploader's module-level setup,
+    and all of them are started here. Call this while the process has a single thread: supervisor.py
+    does, before its service threads start, and fileupload.py run as its own process does, before its
+    upload threads. A fork copies only the calling thread, so a lock that another thread held at that
+    moment (logging, sqlite, requests) would stay locked in the worker."""
+    global _pool
+    if _pool is not None and getattr(_pool, "_broken", False):
+        logging.warning("Encoding workers died; starting new ones")
+        _pool = None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                    initializer=_lower_priority, initargs=(niceness,))
+        for f in [_pool.submit(os.getpid) for _ in range(workers)]:
+            f.result()
+    return _pool
+
+
+def stop_workers():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+class Transcoder:
+    def __init__(self, profile, cache_dir, workers=2, niceness=10):
+        self.profile, self.cache_dir = profile, Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.pool = start_workers(workers, niceness)  # already running if the supervisor started them
+
+    def _paths(self, digest):
+        base = self.cache_dir / f"{digest}-{self.profile.key}"
+        thumb = base.with_name(base.name + "-thumb" + self.profile.ext) if self.profile.thumb else None
+        return base.with_name(base.name + self.profile.ext), thumb
+
+    def prepare(self, src):
+        """Prepared upload for src, from the cache if this content was already encoded with this profile."""
+        src = Path(src)
+        data = src.read_bytes()
+        out, thumb = self._paths(hashlib.sha256(data).hexdigest()[:32])
+        if out.exists() and (thumb is None or thumb.exists()):
+            size, thumb_size, cpu, cached = out.stat().st_size, thumb.stat().st_size if thumb else 0, 0.0, True
+        else:
+            size, thumb_size, cpu = self.pool.submit(encode, src, out, thumb, self.profile).result()
+            cached = False
+        files = tuple(p for p in (out, thumb) if p is not None)
+        if size >= len(data):
+            return Prepared(src, thumb, len(data), len(data), thumb_size, cpu, cached, "image/jpeg", files)  # already smaller
+        return Prepared(out, thumb, len(data), size, thumb_size, cpu, cached, self.profile.mime, files)
+
+    def discard(self, prepared):
+        """Drop the cached encodes of an image once it has been uploaded."""
+        for p in prepared.cache_files:
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+    def prune(self, max_age=7 * 86400):
+        """Remove cache entries older than max_age seconds (images that were never uploaded or were deleted)."""
+        cutoff = time.time() - max_age
+        for p in self.cache_dir.iterdir():
+            try:
+                if p.stat().st_mtime < cutoff:
+                    p.unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """The workers stay up for the next Transcoder in this process (a restarted upload service); stop_workers() ends them."""
+        self.pool = None
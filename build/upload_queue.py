@@ -0,0 +1,79 @@
+# upload_queue.py
+# Durable hand-off of finalized captures from the GUI to the uploader. The GUI
+# appends one file name per line (a single O_APPEND write, fsynced, so a crash
+# never leaves a half line); the uploader reads from a persisted byte offset and
+# only commits it once the batch has been handled, so nothing is lost across
+# restarts. A fully consumed queue is compacted by rename, and anything that
+# slips through is still caught by the uploader's periodic sweep.
+import os
+
+COMPACT_BYTES = 256 * 1024
+
+
+def append(path, name):
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, f"{name}\n".encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class QueueReader:
+    def __init__(self, path, offset_path=None):
+        self.path = str(path)
+        self.offset_path = str(offset_path or f"{path}.offset")
+        self.ino, self.offset = self._load()
+        self.pending = self.offset
+
+    def _load(self):
+        try:
+            ino, offset = open(self.offset_path).read().split()
+            return int(ino), int(offset)
+        except (OSError, ValueError):
+            return None, 0
+
+    def read(self):
+        """New complete entries since the last commit()."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if st.st_ino != self.ino or st.st_size < self.offset:
+            self.ino, self.offset = st.st_ino, 0  # a new queue file (compacted or replaced)
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(st.st_size - self.offset)
+        end = data.rfind(b"\n") + 1  # a line still being written waits for the next read
+        self.pending = self.offset + end
+        return [line.decode(errors="replace").strip() for line in data[:end].split(b"\n") if line.strip()]
+
+    def commit(self):
+        """Mark everything returned by read() as handled."""
+        self.offset = self.pending
+        tmp = f"{self.offset_path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{self.ino} {self.offset}")
+        os.replace(tmp, self.offset_path)
+        if self.offset >= COMPACT_BYTES:
+            self._compact()
+
+    def _compact(self):
+        # Rename, then pick up anything appended between our last read and the rename
+        old = f"{self.path}.old"
+        try:
+            os.replace(self.path, old)
+        except FileNotFoundError:
+            return
+        with open(old, "rb") as f:
+            f.seek(self.offset)
+            tail = f.read()
+        for line in tail.split(b"\n"):
+            if line.strip():
+                append(self.path, line.decode(errors="replace").strip())
+        os.unlink(old)
+        self.ino, self.offset = None, 0
+        try:
+            os.unlink(self.offset_path)
+        except FileNotFoundError:
+            pass
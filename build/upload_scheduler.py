@@ -0,0 +1,123 @@
+# upload_scheduler.py
+# Retry timing for fileupload.py. Failed images get their own next-attempt time
+# (exponential backoff with jitter, stored in the catalog) instead of sleeping in
+# the upload thread, and a circuit breaker stops all uploads once the network
+# itself is failing. While the breaker is open, connectivity is checked with a
+# TCP connect to the upload host rather than by trying real uploads. Each
+# breaker transition is written to a small JSON status file that the GUI shows
+# on the network_wifi indicator.
+import json, os, random, socket, threading, time
+from urllib.parse import urlsplit
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def retry_delay(attempts, base=10.0, cap=3600.0, rng=random):
+    """Seconds before attempt number attempts+1: base * 2^(attempts-1), capped, with equal jitter."""
+    d = min(cap, base * 2 ** max(0, attempts - 1))
+    return d / 2 + rng.uniform(0, d / 2)  # never retries sooner than half the backoff; spreads stations apart
+
+
+def probe(url, timeout=3.0):
+    """True if a TCP connection to the host and port of url can be opened (DNS included)."""
+    u = urlsplit(url)
+    try:
+        socket.create_connection((u.hostname, u.port or (443 if u.scheme == "https" else 80)), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def read_status(path):
+    """Last breaker status written by the uploader, or {} if there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class CircuitBreaker:
+    """closed: uploads flow. open: uploads paused, probes on a backoff. half_open: one trial upload decides."""
+
+    def __init__(self, url, status_path=None, failures=3, probe_base=5.0, probe_cap=300.0, probe_timeout=3.0, rng=random):
+        self.url, self.status_path, self.threshold = url, status_path, failures
+        self.probe_base, self.probe_cap, self.probe_timeout, self.rng = probe_base, probe_cap, probe_timeout, rng
+        self.lock = threading.Lock()
+        self.state, self.failures, self.probes, self.next_probe, self.trial = CLOSED, 0, 0, 0.0, False
+        self.since = time.time()
+        self._write_status()
+
+    def allow(self):
+        """May an upload start now? In half_open only one caller gets through until it reports back."""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = self.probes = 0
+            if self.state != CLOSED:
+                self._set(CLOSED)
+
+    def failure(self):
+        """A connectivity failure (connect error or timeout); HTTP errors do not count."""
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                self._open()  # a failed trial keeps the probe backoff growing
+
+    def release(self):
+        """The half_open trial ended without a verdict (e.g. an HTTP error): let another upload try."""
+        with self.lock:
+            self.trial = False
+
+    def wait_time(self):
+        """Seconds until the next probe is due (0 if not open)."""
+        with self.lock:
+            return max(0.0, self.next_probe - time.monotonic()) if self.state == OPEN else 0.0
+
+    def check(self):
+        """Run a probe if one is due. Returns True when uploads may proceed."""
+        if self.state != OPEN:
+            return True
+        if self.wait_time() > 0:
+            return False
+        ok = probe(self.url, self.probe_timeout)  # outside the lock: up to probe_timeout seconds
+        with self.lock:
+            if self.state != OPEN:
+                return True
+            self.probes += 1
+            if ok:
+                self._set(HALF_OPEN)
+            else:
+                self._open()
+        return ok
+
+    def _open(self):
+        self.next_probe = time.monotonic() + retry_delay(self.probes + 1, self.probe_base, self.probe_cap, self.rng)
+        self._set(OPEN)
+
+    def _set(self, state):
+        if state != self.state:
+            self.since = time.time()
+        self.state, self.trial = state, False
+        self._write_status()
+
+    def _write_status(self):
+        if not self.status_path:
+            return
+        status = {"state": self.state, "since": self.since, "failures": self.failures}
+        if self.state == OPEN:
+            status["next_probe_in"] = round(max(0.0, self.next_probe - time.monotonic()), 1)
+        tmp = f"{self.status_path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(status, f)
+            os.replace(tmp, self.status_path)  # readers never see a partial file
+        except OSError:
+            pass
@@ -0,0 +1,186 @@
+# weight_channel.py
+# Shared-memory channel carrying (seq, interrupt, weight, t_monotonic) samples,
+# plus the settle estimator's provisional weight and confidence when it is enabled,
+# from interrupt_weightread_stability.py to the GUI. The producer writes into a
+# ring of fixed-size slots in an mmap'd file under /dev/shm; readers follow the
+# sequence number, so samples are never torn and any overrun is counted. After
+# each commit the producer pokes a datagram socket next to the file, so a reader
+# can sleep on that fd instead of polling the ring.
+import math, mmap, os, socket, struct, time
+from collections import namedtuple
+from pathlib import Path
+
+MAGIC = b"OWCH"
+VERSION = 2
+SLOTS = 256
+
+# magic, version, slot count, epoch (producer start, ns), last committed seq
+HEADER = struct.Struct("<4sIIxxxxQQ")
+# slot head seq, interrupt, weight, t_monotonic, estimate, confidence, slot tail seq
+SLOT = struct.Struct("<QBxxxxxxxddddQ")
+PAYLOAD = struct.Struct("<Bxxxxxxxdddd")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = HEADER.size - SEQ.size
+
+WeightSample = namedtuple("WeightSample", "seq interrupt weight t_monotonic estimate confidence")
+
+
+def default_path():
+    return Path("/dev/shm/optiwaste_weight") if os.path.isdir("/dev/shm") else Path(os.environ.get("TMP", "/tmp")) / "optiwaste_weight"
+
+
+def channel_path(cfg):
+    return Path(cfg["WEIGHT_CHANNEL"]) if cfg.get("WEIGHT_CHANNEL") else default_path()
+
+
+def notify_path(path):
+    return Path(f"{path}.sock")
+
+
+def _slot_offset(seq, slots):
+    return HEADER.size + (seq % slots) * SLOT.size
+
+
+class WeightChannelWriter:
+    """Single producer. Each publish() is a seqlock-style slot write followed by a header commit."""
+
+    def __init__(self, path=None, slots=SLOTS):
+        self.path, self.slots, self.seq = Path(path or default_path()), slots, 0
+        size = HEADER.size + slots * SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        # A new epoch tells readers that a restarted producer began again at seq 1
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, slots, time.monotonic_ns(), 0)
+        self.notify = None
+        if hasattr(socket, "AF_UNIX"):
+            self.notify = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.notify.setblocking(False)
+
+    def publish(self, interrupt, weight, t=None, estimate=None, confidence=0.0):
+        self.seq += 1
+        off = _slot_offset(self.seq, self.slots)
+        SEQ.pack_into(self.mm, off, self.seq)
+        PAYLOAD.pack_into(self.mm, off + SEQ.size, int(interrupt), float(weight), time.monotonic() if t is None else t,
+                          math.nan if estimate is None else float(estimate), float(confidence))
+        SEQ.pack_into(self.mm, off + SLOT.size - SEQ.size, self.seq)
+        SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq)
+        if self.notify:
+            try:
+                self.notify.sendto(b"\0", str(notify_path(self.path)))
+            except OSError:
+                pass  # no reader listening, or it is behind: the samples are in the ring either way
+        return self.seq
+
+    def close(self):
+        self.mm.close()
+        if self.notify:
+            self.notify.close()
+
+
+class WeightChannelReader:
+    """Follows the producer's sequence. read() returns every sample committed since the last call.
+    With listen=True, fileno() becomes readable whenever the producer commits; drain() re-arms it."""
+
+    def __init__(self, path=None, listen=False):
+        self.path = Path(path or default_path())
+        self.mm, self.epoch, self.last_seq, self.lost = None, None, 0, 0
+        self.sock = None
+        if listen and hasattr(socket, "AF_UNIX"):
+            sock_path = notify_path(self.path)
+            try:
+                sock_path.unlink(missing_ok=True)  # stale socket from a previous run
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self.sock.bind(str(sock_path))
+                self.sock.setblocking(False)
+            except OSError:
+                if self.sock:
+                    self.sock.close()
+                self.sock = None
+
+    def fileno(self):
+        return self.sock.fileno() if self.sock else None
+
+    def drain(self):
+        while self.sock:
+            try:
+                self.sock.recv(64)
+            except BlockingIOError:
+                return
+
+    def _open(self):
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, version, slots, _, _ = HEADER.unpack_from(mm, 0) if len(mm) >= HEADER.size else (b"", 0, 0, 0, 0)
+        if magic != MAGIC or version != VERSION or len(mm) < HEADER.size + slots * SLOT.size:
+            mm.close()
+            return False
+        self.mm, self.slots = mm, slots
+        return True
+
+    def available(self):
+        return self.mm is not None or self._open()
+
+    def read(self):
+        if not self.available():
+            return []
+        _, _, _, epoch, head = HEADER.unpack_from(self.mm, 0)
+        if epoch != self.epoch:
+            # First attach starts at the newest sample; a restarted producer is read from its seq 1
+            self.last_seq = max(0, head - 1) if self.epoch is None else 0
+            self.epoch = epoch
+        first = max(self.last_seq + 1, head - self.slots + 1)
+        self.lost += first - (self.last_seq + 1)
+        out = []
+        for seq in range(first, head + 1):
+            sample = self._read_slot(seq)
+            if sample is None:
+                # Slot was overwritten while we read it; the producer has lapped us
+                self.lost += 1
+                continue
+            out.append(sample)
+        self.last_seq = head
+        return out
+
+    def _read_slot(self, seq):
+        off = _slot_offset(seq, self.slots)
+        for _ in range(3):
+            tail = SEQ.unpack_from(self.mm, off + SLOT.size - SEQ.size)[0]
+            payload = PAYLOAD.unpack_from(self.mm, off + SEQ.size)
+            head = SEQ.unpack_from(self.mm, off)[0]
+            if head == tail == seq:
+                return WeightSample(seq, *payload)
+            if head > seq:
+                return None
+        return None
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+            self.mm = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            notify_path(self.path).unlink(missing_ok=True)
+
+
+# ===== File fallback =====
+def write_file_sample(path, interrupt, weight):
+    # Write-then-rename so a reader never sees a half-written line
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{interrupt},{weight:.2f} kg")
+    os.replace(tmp, path)
+
+
+def read_file_sample(path):
+    flag, weight = open(path).read().strip().split(",", 1)
+    try: wf = float(weight.strip().replace(" kg", ""))
+    except ValueError: wf = 0.0
+    return int(flag), wf
@@ -1,24 +1,12 @@
-import random
-import time
-
-# File path (Windows format)
-file_name = r"E:\Forgevision\Optiwaste\Device\optiwaste\build\raw_interrupt_weight.txt"
-
-while True:
-    # Randomly generate interrupt (0 or 1)
-    interrupt = random.randint(0, 1)
-
-    # Randomly generate weight between 0.2 and 1.0 kg (2 decimal places)
-    weight = round(random.uniform(0.2, 1.0), 2)
-
-    # Prepare the line to write
-    line = f"{interrupt},{weight} kg"
-
-    # Write to file
-    with open(file_name, "w") as f:
-        f.write(line)
-
-    print(f"Data written to {file_name}: {line}")
-
-    # Wait for 2 seconds before the next update
-    time.sleep(2)
\ No newline at end of file
+# weight_interrupt_generator.py
+# Development stand-in for the scale: rewrites raw_interrupt_weight.txt next to this
+# script with simulated load-cell readings (see scale_sim.py). Extra arguments are
+# passed through, e.g. --scenario hand --hz 200 --seed 7.
+import os
+import sys
+from scale_sim import main
+
+file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw_interrupt_weight.txt")
+
+if __name__ == "__main__":
+    sys.exit(main(["--out", "file", "--file", file_name, *sys.argv[1:]]))